@@ -6,7 +6,6 @@ from io import BytesIO
 import numpy as np
 from scipy.io.wavfile import write as write_wav
 from scipy import signal
-from scipy.spatial import cKDTree
 from PIL import Image
 from flask import Flask, request, render_template, jsonify, send_from_directory, session, redirect, url_for
 from colorsys import rgb_to_hsv
@@ -23,8 +22,15 @@ import json
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from functools import lru_cache
 import concurrent.futures
+from functools import partial
+from color_tables import attach_tables, map_unique_colors
+from color_mappings import COLOR_MAPPINGS, DEFAULT_MAPPING, freq_symbols, get_mapping
+from result_cache import ResultCache, result_key, seed_for
+from segment_cache import segment_cache
+from submissions import read_submission
+from synthesis import cached_step_renderer, chord_phase, normalize_to_int16, render_chord, render_sustained, render_timeline
+from timeline import Timeline, build_column_timeline, crop_to_painted, parse_flag, resolve_columns_per_step
 
 
 load_dotenv()
@@ -224,6 +230,8 @@ OUTPUT_DIR = "static/audio"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 SAMPLE_RATE = 44100
 DURATION_PER_STEP = 60 / 1000
+# Identical resubmissions reuse the WAV already rendered for them
+result_cache = ResultCache(OUTPUT_DIR)
 
 # Note-to-semitone mapping
 NOTE_TO_SEMITONE = {
@@ -233,154 +241,9 @@ NOTE_TO_SEMITONE = {
 }
 note_names = list(NOTE_TO_SEMITONE.keys())
 
-# Frequency-to-color mapping
-freq_symbols = {
-    "A0": {"frequency": 27.50, "color": [139, 0, 0], "range": [27.50, 29.14], "symbol": "♩"},
-    "A#0/Bb0": {"frequency": 29.14, "color": [255, 69, 0], "range": [29.14, 30.87], "symbol": "♯"},
-    "B0": {"frequency": 30.87, "color": [204, 204, 0], "range": [30.87, 32.70], "symbol": "♩"},
-    "C1": {"frequency": 32.70, "color": [102, 152, 0], "range": [32.70, 34.65], "symbol": "♩"},
-    "C#1/Db1": {"frequency": 34.65, "color": [0, 100, 0], "range": [34.65, 36.71], "symbol": "♯"},
-    "D1": {"frequency": 36.71, "color": [0, 50, 69], "range": [36.71, 38.89], "symbol": "♩"},
-    "D#1/Eb1": {"frequency": 38.89, "color": [0, 0, 139], "range": [38.89, 41.20], "symbol": "♯"},
-    "E1": {"frequency": 41.20, "color": [75, 0, 130], "range": [41.20, 43.65], "symbol": "♩"},
-    "F1": {"frequency": 43.65, "color": [112, 0, 171], "range": [43.65, 46.25], "symbol": "♩"},
-    "F#1/Gb1": {"frequency": 46.25, "color": [148, 0, 211], "range": [46.25, 49.00], "symbol": "♯"},
-    "G1": {"frequency": 49.00, "color": [157, 0, 106], "range": [49.00, 51.91], "symbol": "♩"},
-    "G#1/Ab1": {"frequency": 51.91, "color": [165, 0, 0], "range": [51.91, 55.00], "symbol": "♯"},
-    "A1": {"frequency": 55.00, "color": [210, 0, 128], "range": [55.00, 58.27], "symbol": "♩"},
-    "A#1/Bb1": {"frequency": 58.27, "color": [255, 94, 0], "range": [58.27, 61.74], "symbol": "♯"},
-    "B1": {"frequency": 61.74, "color": [221, 221, 0], "range": [61.74, 65.41], "symbol": "♩"},
-    "C2": {"frequency": 65.41, "color": [111, 175, 0], "range": [65.41, 69.30], "symbol": "♩"},
-    "C#2/Db2": {"frequency": 69.30, "color": [0, 128, 0], "range": [69.30, 73.42], "symbol": "♯"},
-    "D2": {"frequency": 73.42, "color": [0, 64, 85], "range": [73.42, 77.78], "symbol": "♩"},
-    "D#2/Eb2": {"frequency": 77.78, "color": [0, 0, 170], "range": [77.78, 82.41], "symbol": "♯"},
-    "E2": {"frequency": 82.41, "color": [92, 0, 159], "range": [82.41, 87.31], "symbol": "♩"},
-    "F2": {"frequency": 87.31, "color": [119, 0, 96], "range": [87.31, 92.50], "symbol": "♩"},
-    "F#2/Gb2": {"frequency": 92.50, "color": [159, 0, 226], "range": [92.50, 98.00], "symbol": "♯"},
-    "G2": {"frequency": 98.00, "color": [175, 0, 113], "range": [98.00, 103.83], "symbol": "♩"},
-    "G#2/Ab2": {"frequency": 103.83, "color": [191, 0, 0], "range": [103.83, 110.00], "symbol": "♯"},
-    "A2": {"frequency": 110.00, "color": [223, 59, 128], "range": [110.00, 116.54], "symbol": "♩"},
-    "A#2/Bb2": {"frequency": 116.54, "color": [255, 119, 0], "range": [116.54, 123.47], "symbol": "♯"},
-    "B2": {"frequency": 123.47, "color": [238, 238, 0], "range": [123.47, 130.81], "symbol": "♩"},
-    "C3": {"frequency": 130.81, "color": [119, 159, 0], "range": [130.81, 138.59], "symbol": "♩"},
-    "C#3/Db3": {"frequency": 138.59, "color": [0, 160, 0], "range": [138.59, 146.83], "symbol": "♯"},
-    "D3": {"frequency": 146.83, "color": [0, 80, 100], "range": [146.83, 155.56], "symbol": "♩"},
-    "D#3/Eb3": {"frequency": 155.56, "color": [0, 0, 200], "range": [155.56, 164.81], "symbol": "♯"},
-    "E3": {"frequency": 164.81, "color": [109, 0, 188], "range": [164.81, 174.61], "symbol": "♩"},
-    "F3": {"frequency": 174.61, "color": [140, 0, 215], "range": [174.61, 185.00], "symbol": "♩"},
-    "F#3/Gb3": {"frequency": 185.00, "color": [170, 0, 241], "range": [185.00, 196.00], "symbol": "♯"},
-    "G3": {"frequency": 196.00, "color": [194, 0, 121], "range": [196.00, 207.65], "symbol": "♩"},
-    "G#3/Ab3": {"frequency": 207.65, "color": [217, 0, 0], "range": [207.65, 220.00], "symbol": "♯"},
-    "A3": {"frequency": 220.00, "color": [236, 72, 0], "range": [220.00, 233.08], "symbol": "♩"},
-    "A#3/Bb3": {"frequency": 233.08, "color": [255, 144, 0], "range": [233.08, 246.94], "symbol": "♯"},
-    "B3": {"frequency": 246.94, "color": [255, 255, 0], "range": [246.94, 261.63], "symbol": "♩"},
-    "C4": {"frequency": 261.63, "color": [128, 224, 0], "range": [261.63, 277.18], "symbol": "♩"},
-    "C#4/Db4": {"frequency": 277.18, "color": [0, 192, 0], "range": [277.18, 293.66], "symbol": "♯"},
-    "D4": {"frequency": 293.66, "color": [0, 96, 115], "range": [293.66, 311.13], "symbol": "♩"},
-    "D#4/Eb4": {"frequency": 311.13, "color": [0, 0, 230], "range": [311.13, 329.63], "symbol": "♯"},
-    "E4": {"frequency": 329.63, "color": [126, 0, 217], "range": [329.63, 349.23], "symbol": "♩"},
-    "F4": {"frequency": 349.23, "color": [159, 26, 236], "range": [349.23, 369.99], "symbol": "♩"},
-    "F#4/Gb4": {"frequency": 369.99, "color": [191, 51, 255], "range": [369.99, 392.00], "symbol": "♯"},
-    "G4": {"frequency": 392.00, "color": [217, 26, 128], "range": [392.00, 415.30], "symbol": "♩"},
-    "G#4/Ab4": {"frequency": 415.30, "color": [243, 0, 0], "range": [415.30, 440.00], "symbol": "♯"},
-    "A4": {"frequency": 440.00, "color": [249, 85, 0], "range": [440.00, 466.16], "symbol": "♩"},
-    "A#4/Bb4": {"frequency": 466.16, "color": [255, 169, 0], "range": [466.16, 493.88], "symbol": "♯"},
-    "B4": {"frequency": 493.88, "color": [255, 255, 51], "range": [493.88, 523.25], "symbol": "♩"},
-    "C5": {"frequency": 523.25, "color": [153, 255, 51], "range": [523.25, 554.37], "symbol": "♩"},
-    "C#5/Db5": {"frequency": 554.37, "color": [51, 255, 51], "range": [554.37, 587.33], "symbol": "♯"},
-    "D5": {"frequency": 587.33, "color": [51, 204, 204], "range": [587.33, 622.25], "symbol": "♪"},
-    "D#5/Eb5": {"frequency": 622.25, "color": [51, 51, 255], "range": [622.25, 659.25], "symbol": "♭"},
-    "E5": {"frequency": 659.25, "color": [128, 51, 255], "range": [659.25, 698.46], "symbol": "𝅘𝅥𝅮"},
-    "F5": {"frequency": 698.46, "color": [159, 87, 255], "range": [698.46, 739.99], "symbol": "♩"},
-    "F#5/Gb5": {"frequency": 739.99, "color": [190, 123, 255], "range": [739.99, 783.99], "symbol": "♯"},
-    "G5": {"frequency": 783.99, "color": [204, 87, 128], "range": [783.99, 830.61], "symbol": "♫"},
-    "G#5/Ab5": {"frequency": 830.61, "color": [255, 51, 51], "range": [830.61, 880.00], "symbol": "♭"},
-    "A5": {"frequency": 880.00, "color": [255, 128, 102], "range": [880.00, 932.33], "symbol": "𝅗𝅥"},
-    "A#5/Bb5": {"frequency": 932.33, "color": [255, 204, 102], "range": [932.33, 987.77], "symbol": "♯"},
-    "B5": {"frequency": 987.77, "color": [255, 255, 102], "range": [987.77, 1046.50], "symbol": "𝅘𝅥"},
-    "C6": {"frequency": 1046.50, "color": [179, 255, 102], "range": [1046.50, 1108.73], "symbol": "♩"},
-    "C#6/Db6": {"frequency": 1108.73, "color": [102, 255, 102], "range": [1108.73, 1174.66], "symbol": "♯"},
-    "D6": {"frequency": 1174.66, "color": [102, 204, 204], "range": [1174.66, 1244.51], "symbol": "♪"},
-    "D#6/Eb6": {"frequency": 1244.51, "color": [102, 102, 255], "range": [1244.51, 1318.51], "symbol": "♭"},
-    "E6": {"frequency": 1318.51, "color": [153, 102, 255], "range": [1318.51, 1396.91], "symbol": "𝅘𝅥𝅮"},
-    "F6": {"frequency": 1396.91, "color": [171, 128, 255], "range": [1396.91, 1479.98], "symbol": "♩"},
-    "F#6/Gb6": {"frequency": 1479.98, "color": [201, 153, 255], "range": [1479.98, 1567.98], "symbol": "♯"},
-    "G6": {"frequency": 1567.98, "color": [209, 128, 153], "range": [1567.98, 1661.22], "symbol": "♫"},
-    "G#6/Ab6": {"frequency": 1661.22, "color": [255, 102, 102], "range": [1661.22, 1760.00], "symbol": "♭"},
-    "A6": {"frequency": 1760.00, "color": [255, 153, 128], "range": [1760.00, 1864.66], "symbol": "𝅗𝅥"},
-    "A#6/Bb6": {"frequency": 1864.66, "color": [255, 204, 153], "range": [1864.66, 1975.53], "symbol": "♯"},
-    "B6": {"frequency": 1975.53, "color": [255, 255, 153], "range": [1975.53, 2093.00], "symbol": "𝅘𝅥"},
-    "C7": {"frequency": 2093.00, "color": [204, 255, 153], "range": [2093.00, 2217.46], "symbol": "♩"},
-    "C#7/Db7": {"frequency": 2217.46, "color": [153, 255, 153], "range": [2217.46, 2349.32], "symbol": "♯"},
-    "D7": {"frequency": 2349.32, "color": [153, 204, 204], "range": [2349.32, 2489.02], "symbol": "♪"},
-    "D#7/Eb7": {"frequency": 2489.02, "color": [153, 153, 255], "range": [2489.02, 2637.02], "symbol": "♭"},
-    "E7": {"frequency": 2637.02, "color": [197, 153, 255], "range": [2637.02, 2793.83], "symbol": "𝅘𝅥𝅮"},
-    "F7": {"frequency": 2793.83, "color": [222, 176, 255], "range": [2793.83, 2959.96], "symbol": "♩"},
-    "F#7/Gb7": {"frequency": 2959.96, "color": [246, 198, 255], "range": [2959.96, 3135.96], "symbol": "♯"},
-    "G7": {"frequency": 3135.96, "color": [255, 176, 204], "range": [3135.96, 3322.44], "symbol": "♫"},
-    "G#7/Ab7": {"frequency": 3322.44, "color": [255, 153, 153], "range": [3322.44, 3520.00], "symbol": "♭"},
-    "A7": {"frequency": 3520.00, "color": [255, 194, 176], "range": [3520.00, 3729.31], "symbol": "𝅗𝅥"},
-    "A#7/Bb7": {"frequency": 3729.31, "color": [255, 234, 198], "range": [3729.31, 3951.07], "symbol": "♯"},
-    "B7": {"frequency": 3951.07, "color": [255, 255, 204], "range": [3951.07, 4186.01], "symbol": "𝅘𝅥"},
-    "C8": {"frequency": 4186.01, "color": [144, 238, 144], "range": [4186.01, 4434.92], "symbol": "♩"},
-}
-
-# Optimized Color Processing with KD-Tree
-color_tree = None
-color_list = None
-freq_list = None
-
-def setup_color_tree():
-    """Initialize KD-Tree for fast color lookup"""
-    global color_tree, color_list, freq_list
-    if color_tree is None:
-        colors = []
-        frequencies = []
-        for note, props in freq_symbols.items():
-            colors.append(props["color"])
-            frequencies.append(props["frequency"])
-        
-        color_list = np.array(colors)
-        freq_list = np.array(frequencies)
-        color_tree = cKDTree(color_list)
-        logger.info("KD-Tree initialized for fast color lookup")
-
-@lru_cache(maxsize=1000)
 def get_frequency_optimized(r, g, b):
-    """Optimized frequency lookup with caching"""
-    setup_color_tree()
-    
-    # First try exact match
-    target = [r, g, b]
-    for note, props in freq_symbols.items():
-        if props["color"] == target:
-            return props["frequency"]
-    
-    # Use KD-Tree for nearest neighbor search
-    distance, index = color_tree.query(target)
-    
-    # If very close, use exact match
-    if distance < 15:  # Threshold for "close enough"
-        return freq_list[index]
-    
-    # Otherwise interpolate for smoother transitions
-    return interpolate_frequency(target, index)
-
-def interpolate_frequency(color, nearest_index):
-    """Interpolate frequency based on color proximity"""
-    nearest_color = color_list[nearest_index]
-    base_freq = freq_list[nearest_index]
-    
-    # Calculate hue-based adjustment
-    hsv1 = rgb_to_hsv(*(c/255 for c in color))
-    hsv2 = rgb_to_hsv(*(c/255 for c in nearest_color))
-    
-    hue_diff = abs(hsv1[0] - hsv2[0])
-    hue_diff = min(hue_diff, 1 - hue_diff)  # Wrap around
-    
-    # Small frequency variation based on hue difference
-    freq_multiplier = 1 + (hue_diff - 0.5) * 0.1  # ±5% variation
-    return base_freq * freq_multiplier
+    """Optimized frequency lookup backed by the precomputed RGB table"""
+    return float(get_mapping(DEFAULT_MAPPING).map(np.array([[r, g, b]]))[0])
 
 # Keep original functions for compatibility
 def hue_to_note_name(hue):
@@ -412,8 +275,17 @@ def get_frequency_from_color(r, g, b, threshold=10000):
 def color_distance(c1, c2):
     return sum((a - b) ** 2 for a, b in zip(c1, c2)) ** 0.5
 
-def process_image_optimized(img):
-    """Optimized image processing with vectorized operations"""
+def process_image_optimized(img, mapping=None, columns_per_step=1, weighted=False):
+    """Optimized image processing with vectorized operations
+
+    With ``weighted``, each note's amplitude is its coverage of the step: painted pixels
+    over image height x columns_per_step, so wider strokes play louder.
+    """
+    # Crop to the painted region; empty or all-black canvases never reach the array stage
+    canvas_height = img.height
+    img, x_offset = crop_to_painted(img)
+    if img is None:
+        return Timeline.empty()
     width, height = img.size
     
     # Convert image to numpy array for vectorized processing
@@ -427,82 +299,77 @@ def process_image_optimized(img):
     valid_pixels = pixels[valid_mask]
     
     if len(valid_pixels) == 0:
-        return {}
+        return Timeline.empty()
     
-    # Process colors in batches
-    timeline = {}
+    # Get canvas x coordinates for each valid pixel
+    x_coords = np.flatnonzero(valid_mask) % width + x_offset
     
-    # Get x coordinates for each pixel
-    x_coords = np.arange(len(pixels)) % width
+    # Map each distinct color once and scatter back to every valid pixel
+    color_mapping = get_mapping(mapping)
+    frequencies, unique_colors = map_unique_colors(valid_pixels[:, :3], color_mapping.map)
+    logger.info(f"Mapped {len(valid_pixels)} pixels through {unique_colors} unique colors ({color_mapping.name})")
     
-    # Process each valid pixel
-    for i, pixel in enumerate(valid_pixels):
-        if valid_mask[i]:
-            x_coord = x_coords[i]
-            r, g, b, a = pixel
-            
-            # Use optimized frequency lookup
-            freq = get_frequency_optimized(r, g, b)
-            
-            if freq and freq > 0:
-                if x_coord not in timeline:
-                    timeline[x_coord] = []
-                timeline[x_coord].append(freq)
-    
-    # Remove duplicates and sort frequencies for each column
-    for x in timeline:
-        timeline[x] = sorted(list(set(timeline[x])))
-    
-    return timeline
+    # Group by step (columns_per_step columns each) with sorted, duplicate-free frequencies
+    return build_column_timeline(
+        x_coords, frequencies, columns_per_step, weighted, step_capacity=canvas_height * columns_per_step
+    )
+
+# Map the default color table at boot so every worker starts warm; other mappings build
+# their tables on first use (the host build lock keeps that to one builder per table)
+attach_tables(get_mapping(DEFAULT_MAPPING).table)
 
 # Tone generation function
-def generate_tone(frequencies, brush, duration=DURATION_PER_STEP):
-    valid_brushes = {"spray", "star", "cross", "square", "triangle", "sawtooth", "round", "line"}
-    if brush.lower() not in valid_brushes:
-        raise ValueError(f"Invalid brush type: {brush}. Valid options are {valid_brushes}")
+VALID_BRUSHES = {"spray", "star", "cross", "square", "triangle", "sawtooth", "round", "line"}
+
+def chord_tones(freqs, t, brush, rng=None):
+    """Brush-shaped tones for a block of chord notes, one row per frequency"""
+    phase = chord_phase(freqs, t)
+    if brush.lower() == "spray":
+        mod_ratio = 1.7 + 0.3 * np.sin(2 * np.pi * 0.2 * t)
+        carrier = np.sin(phase + 3 * np.sin(mod_ratio * phase))
+        tones = carrier * (0.6 + 0.4 * np.sin(2 * np.pi * 5 * t))
+        noise = 0.15 * (rng or np.random).normal(0, 1, phase.shape)
+        noise = signal.lfilter(*signal.butter(4, 1000/(SAMPLE_RATE/2)), noise, axis=-1)
+        return tones * (0.7 + 0.3 * np.sin(2 * np.pi * 3 * t)) + noise
+    elif brush.lower() == "star":
+        harmonics = [(1, 0.6), (2, 0.4), (3, 0.3), (5, 0.2)]
+        tones = sum(np.sin(h * phase) * amp for h, amp in harmonics)
+        detune = 1 + 0.001 * np.sin(2 * np.pi * 0.1 * t)
+        return tones * detune
+    elif brush.lower() == "cross":
+        distorted_phase = phase + 0.8 * np.sin(phase)
+        return np.sin(distorted_phase) * np.sin(2 * distorted_phase)
+    elif brush.lower() == "square":
+        pw = 0.5 + 0.3 * np.sin(2 * np.pi * 0.5 * t)
+        return signal.square(phase, duty=pw)
+    elif brush.lower() == "triangle":
+        tones = signal.sawtooth(phase, width=0.5)
+        tones -= 0.25 * signal.sawtooth(2 * phase, width=0.5)
+        return tones
+    elif brush.lower() == "sawtooth":
+        detune = [0.99, 1.0, 1.01]
+        return sum(0.4 * np.sin(d * phase) for d in detune)
+    else:  # round or line
+        vibrato = 0.1 * np.sin(2 * np.pi * 6 * t)
+        return 0.9 * np.sin(phase + vibrato) + 0.1 * np.sin(3 * phase)
+
+def generate_tone(frequencies, brush, duration=DURATION_PER_STEP, rng=None, amplitudes=None):
+    # rng: optional numpy Generator for brush noise, so cached renders are reproducible
+    # amplitudes: optional per-frequency gains from a weighted timeline (default all 1);
+    # weighted steps keep their coverage level, so only flat chords are peak-normalized
+    if brush.lower() not in VALID_BRUSHES:
+        raise ValueError(f"Invalid brush type: {brush}. Valid options are {VALID_BRUSHES}")
 
     t = np.linspace(0, duration, int(SAMPLE_RATE * duration), False)
     
-    if frequencies == 0:
-        return np.zeros_like(t)
-
+    # Silent steps arrive as 0 or as an empty timeline column
     if not isinstance(frequencies, (list, np.ndarray)) or len(frequencies) == 0:
         return np.zeros_like(t)
 
     frequencies = np.clip(frequencies, 20, 20000)
-    waveform = np.zeros_like(t)
-
-    for freq in frequencies:
-        phase = 2 * np.pi * freq * t
-        if brush.lower() == "spray":
-            mod_ratio = 1.7 + 0.3 * np.sin(2 * np.pi * 0.2 * t)
-            carrier = np.sin(phase + 3 * np.sin(mod_ratio * phase))
-            tone = carrier * (0.6 + 0.4 * np.sin(2 * np.pi * 5 * t))
-            noise = 0.15 * np.random.normal(0, 1, len(t))
-            noise = signal.lfilter(*signal.butter(4, 1000/(SAMPLE_RATE/2)), noise)
-            tone = tone * (0.7 + 0.3 * np.sin(2 * np.pi * 3 * t)) + noise
-        elif brush.lower() == "star":
-            harmonics = [(1, 0.6), (2, 0.4), (3, 0.3), (5, 0.2)]
-            tone = sum(np.sin(h * phase) * amp for h, amp in harmonics)
-            detune = 1 + 0.001 * np.sin(2 * np.pi * 0.1 * t)
-            tone = tone * detune
-        elif brush.lower() == "cross":
-            distorted_phase = phase + 0.8 * np.sin(phase)
-            tone = np.sin(distorted_phase) * np.sin(2 * distorted_phase)
-        elif brush.lower() == "square":
-            pw = 0.5 + 0.3 * np.sin(2 * np.pi * 0.5 * t)
-            tone = signal.square(phase, duty=pw)
-        elif brush.lower() == "triangle":
-            tone = signal.sawtooth(phase, width=0.5)
-            tone -= 0.25 * signal.sawtooth(2 * phase, width=0.5)
-        elif brush.lower() == "sawtooth":
-            detune = [0.99, 1.0, 1.01]
-            tone = sum(0.4 * np.sin(2 * np.pi * d * freq * t) for d in detune)
-        else:  # round or line
-            vibrato = 0.1 * np.sin(2 * np.pi * 6 * t)
-            tone = 0.9 * np.sin(phase + vibrato) + 0.1 * np.sin(3 * phase)
-        
-        waveform += tone
+
+    # Each brush is array math over a block of chord notes, one row per frequency
+    waveform = render_chord(frequencies, lambda freqs: chord_tones(freqs, t, brush, rng), amplitudes)
 
     envelope = np.ones_like(t)
     attack_len = int(0.1 * len(t))
@@ -512,11 +379,18 @@ def generate_tone(frequencies, brush, duration=DURATION_PER_STEP):
     waveform *= envelope
 
     max_val = np.max(np.abs(waveform))
-    if max_val > 0:
+    if max_val > 0 and amplitudes is None:
         waveform /= max_val
 
     return waveform
 
+def step_renderer(brush):
+    """generate_tone for one step at a time, answered from the shared segment cache"""
+    return cached_step_renderer(
+        segment_cache, partial(generate_tone, brush=brush),
+        brush=brush, duration=DURATION_PER_STEP, sample_rate=SAMPLE_RATE
+    )
+
 
 # Azure Marketplace Metered Billing
 def report_metered_usage(subscription_id, quantity):
@@ -1214,52 +1088,77 @@ def submit():
             """, (subscription_id, submission_key, None, ADDITIONAL_SUBMISSION_COST))
             logger.info(f"Charged ${ADDITIONAL_SUBMISSION_COST} for additional submission {submission_count + 1} by {submission_key}")
             report_metered_usage(subscription_id, 1) # Report 1 additional submission
-        data = request.json
-        if 'image' not in data:
+        data, image_bytes = read_submission()
+        if image_bytes is None:
             logger.error("No image provided in request")
             return jsonify({"error": "No image provided"}), 400
         brush = data.get('brush', 'round')
-        image_data = data['image'].split(',')[1]
+        mapping = data.get('mapping', DEFAULT_MAPPING)
+        if mapping not in COLOR_MAPPINGS:
+            logger.error(f"Unknown color mapping requested: {mapping}")
+            return jsonify({"error": f"Invalid mapping: {mapping}. Valid options are {sorted(COLOR_MAPPINGS)}"}), 400
         try:
-            img = Image.open(BytesIO(base64.b64decode(image_data))).convert('RGBA')
+            img = Image.open(BytesIO(image_bytes)).convert('RGBA')
         except Exception as e:
             logger.error(f"Invalid image data: {str(e)}")
             return jsonify({"error": f"Invalid image data: {str(e)}"}), 400
         width, height = img.size
         logger.info(f"Received image size: {width}x{height}")
+        try:
+            columns_per_step = resolve_columns_per_step(
+                width, DURATION_PER_STEP, data.get('columns_per_step'), data.get('duration')
+            )
+        except (TypeError, ValueError) as e:
+            logger.error(f"Invalid time resolution: {str(e)}")
+            return jsonify({"error": f"Invalid time resolution: {str(e)}"}), 400
         
-        # Optimized image processing with vectorized operations
-        start_time = time.time()
-        timeline = process_image_optimized(img)
-        processing_time = time.time() - start_time
-        logger.info(f"Optimized processing completed in {processing_time:.2f} seconds")
-        
-        non_silent_columns = {x: freqs for x, freqs in timeline.items() if freqs}
-        logger.info(f"Processed {len(non_silent_columns)} non-silent columns")
-        
-        stop = max((x for x, freqs in timeline.items() if freqs), default=0)
-        timeline = {x: freqs if freqs else 0 for x in range(stop + 1)}
-        
-        if not non_silent_columns:
-            logger.warning("No valid colors detected in image")
-            return jsonify({"error": "No valid colors detected"}), 400
-        
-        # Parallel audio generation
-        start_time = time.time()
-        audio_segments = []
-        for x in range(stop + 1):
-            segment = generate_tone(timeline.get(x, 0), brush)
-            audio_segments.append(segment)
-        
-        audio = np.concatenate(audio_segments)
-        audio = audio / np.max(np.abs(audio))
-        audio_int16 = np.int16(audio * 32767)
-        audio_time = time.time() - start_time
-        logger.info(f"Audio generation completed in {audio_time:.2f} seconds")
-        filename = f"sound_{int(time.time() * 1000)}.wav"
-        filepath = os.path.join(OUTPUT_DIR, filename)
-        write_wav(filepath, SAMPLE_RATE, audio_int16)
-        logger.info(f"Generated audio file: {filename}")
+        weighted = parse_flag(data.get('weighted', False))
+        sustain = parse_flag(data.get('sustain', False))
+        key = result_key(
+            np.asarray(img), brush=brush, mapping=mapping, columns_per_step=columns_per_step,
+            weighted=weighted, sustain=sustain
+        )
+        cached = result_cache.get(key)
+        if cached is not None:
+            # Same canvas and settings as an earlier render; reuse its file
+            filename = cached["filename"]
+            logger.info(f"Reusing cached audio file: {filename}")
+        else:
+            # Optimized image processing with vectorized operations
+            start_time = time.time()
+            timeline = process_image_optimized(img, mapping, columns_per_step, weighted)
+            processing_time = time.time() - start_time
+            logger.info(f"Optimized processing completed in {processing_time:.2f} seconds")
+            
+            logger.info(f"Processed {timeline.non_silent_columns} non-silent columns ({timeline.nbytes} bytes)")
+            
+            if not timeline:
+                logger.warning("No valid colors detected in image")
+                return jsonify({"error": "No valid colors detected"}), 400
+            
+            # Single-pass rendering into one preallocated buffer; silent steps stay zero
+            start_time = time.time()
+            if sustain:
+                # Held colors become one continuous note each
+                if brush.lower() not in VALID_BRUSHES:
+                    raise ValueError(f"Invalid brush type: {brush}. Valid options are {VALID_BRUSHES}")
+                rng = np.random.default_rng(seed_for(key))
+                audio = render_sustained(
+                    timeline, lambda freqs, t: chord_tones(freqs, t, brush, rng),
+                    int(SAMPLE_RATE * DURATION_PER_STEP), SAMPLE_RATE, attack=0.1, decay=5.0
+                )
+            else:
+                # Steps seen in earlier requests are copied from the segment cache
+                audio = render_timeline(timeline, step_renderer(brush), int(SAMPLE_RATE * DURATION_PER_STEP))
+                logger.info(f"Segment cache: {segment_cache.stats()}")
+            audio_int16 = normalize_to_int16(audio)
+            audio_time = time.time() - start_time
+            logger.info(f"Audio generation completed in {audio_time:.2f} seconds")
+            filename = f"sound_{int(time.time() * 1000)}.wav"
+            filepath = os.path.join(OUTPUT_DIR, filename)
+            write_wav(filepath, SAMPLE_RATE, audio_int16)
+            logger.info(f"Generated audio file: {filename}")
+            result_cache.put(key, [filename], {"filename": filename})
         # Store submission in database
         insert_query = """
             INSERT INTO submissions (user_email, submission_date, image_data, audio_path, brush_type, ip_address)
@@ -1269,7 +1168,7 @@ def submit():
         cursor.execute(insert_query, (
             session['user']['email'] if is_authenticated else None,
             datetime.now(),
-            image_data,
+            base64.b64encode(image_bytes).decode('ascii'),
             filename,
             brush,
             request.remote_addr
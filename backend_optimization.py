@@ -1,13 +1,79 @@
 # Backend Performance Optimizations
 import asyncio
+import atexit
 import concurrent.futures
+import logging
 from functools import lru_cache
 import multiprocessing as mp
+from multiprocessing import shared_memory
+import threading
+import numpy as np
+from PIL import Image
+from color_tables import map_unique_colors
+from synthesis import chord_phase, render_chord
+from timeline import Timeline, build_column_timeline
+
+logger = logging.getLogger(__name__)
+
+# Set in each pool worker by _init_strip_worker
+_strip_processor = None
+
+def _init_strip_worker():
+    """Pool initializer: map the color tables once per worker process"""
+    global _strip_processor
+    from optimized_audio import advanced_processor
+    _strip_processor = advanced_processor
+
+def _map_strip(strip, start_x):
+    """Map every valid pixel of a strip in one batch and group it by canvas column"""
+    valid_mask = (strip[..., 3] > 200) & strip[..., :3].any(axis=-1)
+    ys, xs = np.nonzero(valid_mask)
+    if len(xs) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    frequencies, _ = map_unique_colors(strip[ys, xs, :3], _strip_processor.map_colors)
+    strip_timeline = build_column_timeline(xs + start_x, frequencies)
+    return strip_timeline.column_index(), strip_timeline.notes
+
+def _process_strip(shm_name, shape, start_x, end_x):
+    """Map one vertical strip of a shared RGBA image in bulk.
+    Returns (canvas column per entry, frequency per entry) sorted by column."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        # Strided view into the parent's buffer; only this strip's pixels are touched
+        pixels = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        return _map_strip(pixels[:, start_x:end_x], start_x)
+    finally:
+        # The views above are released on return, so the mapping can be closed
+        pixels = None
+        shm.close()
+
+_audio_engine = None
+_audio_engine_lock = threading.Lock()
+
+def get_audio_engine():
+    """The process-wide engine, created on first use and shut down at exit.
+    Lazy because spawned strip workers import this module too."""
+    global _audio_engine
+    with _audio_engine_lock:
+        if _audio_engine is None:
+            _audio_engine = HighPerformanceAudioEngine()
+            atexit.register(_audio_engine.shutdown)
+        return _audio_engine
 
 class HighPerformanceAudioEngine:
-    def __init__(self):
+    def __init__(self, strip_workers=None):
         self.thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
-        self.process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=2)
+        # Persistent pool: workers keep their mapped color tables between requests
+        self.strip_workers = strip_workers or mp.cpu_count()
+        self.process_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.strip_workers,
+            mp_context=mp.get_context('spawn'),
+            initializer=_init_strip_worker
+        )
+
+    def shutdown(self):
+        self.thread_pool.shutdown()
+        self.process_pool.shutdown()
         
     @lru_cache(maxsize=1000)
     def get_frequency_cached(self, r, g, b):
@@ -15,62 +81,42 @@ class HighPerformanceAudioEngine:
         return self.get_frequency_fast(r, g, b)
     
     async def process_image_parallel(self, image_data):
-        """Process image in parallel chunks for better performance"""
+        """Process image in parallel strips across worker processes"""
         img = Image.open(image_data).convert('RGBA')
         width, height = img.size
         
-        # Split image into vertical strips for parallel processing
-        num_strips = min(4, width)
-        strip_width = width // num_strips
-        
-        tasks = []
-        for i in range(num_strips):
-            start_x = i * strip_width
-            end_x = (i + 1) * strip_width if i < num_strips - 1 else width
+        # Decode once into shared memory; workers attach to it instead of receiving pixels
+        shm = shared_memory.SharedMemory(create=True, size=width * height * 4)
+        pixels = None
+        try:
+            pixels = np.ndarray((height, width, 4), dtype=np.uint8, buffer=shm.buf)
+            pixels[:] = np.asarray(img)
+            del img
             
-            # Process strip in separate thread
-            task = asyncio.create_task(
-                self.process_image_strip_async(img, start_x, end_x)
-            )
-            tasks.append(task)
-        
-        # Wait for all strips to complete
-        results = await asyncio.gather(*tasks)
-        
-        # Combine results
-        timeline = {}
-        for strip_result in results:
-            timeline.update(strip_result)
-        
-        return timeline
-    
-    async def process_image_strip_async(self, img, start_x, end_x):
-        """Async wrapper for strip processing"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            self.thread_pool,
-            self.process_image_strip,
-            img, start_x, end_x
-        )
-    
-    def process_image_strip(self, img, start_x, end_x):
-        """Process a vertical strip of the image"""
-        width, height = img.size
-        timeline = {}
-        
-        for x in range(start_x, end_x):
-            freqs = []
-            for y in range(height):
-                r, g, b, a = img.load()[x, y]
-                if not (r == 0 and g == 0 and b == 0) and a > 200:
-                    freq = self.get_frequency_cached(r, g, b)
-                    if freq:
-                        freqs.append(freq)
+            # Split image into vertical strips, one per worker
+            num_strips = min(self.strip_workers, width)
+            bounds = np.linspace(0, width, num_strips + 1, dtype=int)
             
-            if freqs:
-                timeline[x] = list(np.unique(freqs))
+            loop = asyncio.get_running_loop()
+            tasks = [
+                loop.run_in_executor(
+                    self.process_pool, _process_strip,
+                    shm.name, pixels.shape, int(start_x), int(end_x)
+                )
+                for start_x, end_x in zip(bounds[:-1], bounds[1:])
+            ]
+            
+            # Wait for all strips to complete
+            results = await asyncio.gather(*tasks)
+        finally:
+            pixels = None
+            shm.close()
+            shm.unlink()
         
-        return timeline
+        # Strips cover disjoint, ordered column ranges, so entries concatenate already sorted
+        columns = np.concatenate([strip_columns for strip_columns, _ in results])
+        notes = np.concatenate([strip_notes for _, strip_notes in results])
+        return Timeline.from_entries(columns, notes)
     
     def generate_audio_parallel(self, timeline, brush):
         """Generate audio segments in parallel"""
@@ -101,7 +147,7 @@ class HighPerformanceAudioEngine:
     
     def generate_tone_optimized(self, frequencies, brush, duration=DURATION_PER_STEP):
         """Optimized tone generation with vectorized operations"""
-        if not frequencies or frequencies == 0:
+        if not isinstance(frequencies, (list, np.ndarray)) or len(frequencies) == 0:
             return np.zeros(int(SAMPLE_RATE * duration))
         
         t = np.linspace(0, duration, int(SAMPLE_RATE * duration), False)
@@ -134,62 +180,44 @@ class HighPerformanceAudioEngine:
     
     def generate_sine_wave(self, t, frequencies):
         """Vectorized sine wave generation"""
-        waveform = np.zeros_like(t)
-        for freq in frequencies:
-            phase = 2 * np.pi * freq * t
-            waveform += np.sin(phase)
-        return waveform
+        return render_chord(frequencies, lambda freqs: np.sin(chord_phase(freqs, t)))
     
     def generate_square_wave(self, t, frequencies):
         """Vectorized square wave generation"""
-        waveform = np.zeros_like(t)
-        for freq in frequencies:
-            phase = 2 * np.pi * freq * t
-            waveform += signal.square(phase)
-        return waveform
+        return render_chord(frequencies, lambda freqs: signal.square(chord_phase(freqs, t)))
     
     def generate_triangle_wave(self, t, frequencies):
         """Vectorized triangle wave generation"""
-        waveform = np.zeros_like(t)
-        for freq in frequencies:
-            phase = 2 * np.pi * freq * t
-            waveform += signal.sawtooth(phase, width=0.5)
-        return waveform
+        return render_chord(frequencies, lambda freqs: signal.sawtooth(chord_phase(freqs, t), width=0.5))
     
     def generate_sawtooth_wave(self, t, frequencies):
         """Vectorized sawtooth wave generation"""
-        waveform = np.zeros_like(t)
-        for freq in frequencies:
-            phase = 2 * np.pi * freq * t
-            waveform += signal.sawtooth(phase)
-        return waveform
+        return render_chord(frequencies, lambda freqs: signal.sawtooth(chord_phase(freqs, t)))
     
     def generate_complex_wave(self, t, frequencies, brush):
         """Generate complex waveforms for special brushes"""
-        waveform = np.zeros_like(t)
-        
-        for freq in frequencies:
-            phase = 2 * np.pi * freq * t
+        def voice(freqs):
+            phase = chord_phase(freqs, t)
             
             if brush.lower() == "spray":
                 # Complex modulated waveform
                 mod_ratio = 1.7 + 0.3 * np.sin(2 * np.pi * 0.2 * t)
                 carrier = np.sin(phase + 3 * np.sin(mod_ratio * phase))
-                tone = carrier * (0.6 + 0.4 * np.sin(2 * np.pi * 5 * t))
-                waveform += tone
+                return carrier * (0.6 + 0.4 * np.sin(2 * np.pi * 5 * t))
                 
             elif brush.lower() == "star":
                 # Harmonic-rich waveform
                 harmonics = [(1, 0.6), (2, 0.4), (3, 0.3), (5, 0.2)]
-                for h, amp in harmonics:
-                    waveform += np.sin(h * phase) * amp
+                return sum(np.sin(h * phase) * amp for h, amp in harmonics)
                     
             elif brush.lower() == "cross":
                 # Distorted waveform
                 distorted_phase = phase + 0.8 * np.sin(phase)
-                waveform += np.sin(distorted_phase) * np.sin(2 * distorted_phase)
+                return np.sin(distorted_phase) * np.sin(2 * distorted_phase)
+            
+            return np.zeros_like(phase)
         
-        return waveform
+        return render_chord(frequencies, voice)
     
     def generate_envelope(self, t):
         """Generate ADSR envelope"""
@@ -209,8 +237,8 @@ def submit_optimized():
     try:
         # ... existing validation code ...
         
-        # Initialize high-performance engine
-        audio_engine = HighPerformanceAudioEngine()
+        # Shared engine; its worker pool persists across requests
+        audio_engine = get_audio_engine()
         
         # Process image asynchronously
         loop = asyncio.new_event_loop()
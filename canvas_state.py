@@ -0,0 +1,155 @@
+# Server-side Canvas State for Incremental Submissions
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from timeline import Timeline
+
+# Canvases kept in memory per process; the least recently used one is dropped first
+MAX_CANVAS_STATES = int(os.getenv('MAX_CANVAS_STATES', 32))
+# Bytes of pixels and rendered segments those canvases may hold in total
+MAX_CANVAS_BYTES = int(os.getenv('MAX_CANVAS_BYTES', 128 * 1024 * 1024))
+
+_EMPTY_STEP = np.zeros(0, dtype=np.float32)
+
+
+class CanvasState:
+    """A session's canvas pixels plus the per-step notes and audio derived from them
+
+    ``process_fn(img, columns_per_step)`` turns an RGBA image into a Timeline, weighted
+    or not. Dirty rectangles only re-run it over the steps their columns fall in, and
+    rendered segments for every other step are reused while the render settings stay the same.
+    """
+
+    def __init__(self, pixels: np.ndarray, process_fn: Callable[[Image.Image, int], Timeline],
+                 columns_per_step: int = 1):
+        self.pixels = np.array(pixels, dtype=np.uint8)  # Own, writable (H, W, 4) copy
+        self.process_fn = process_fn
+        self.columns_per_step = columns_per_step
+        n_steps = -(-self.width // columns_per_step)
+        self.step_notes: List[np.ndarray] = [_EMPTY_STEP] * n_steps
+        self.step_amplitudes: List[Optional[np.ndarray]] = [None] * n_steps
+        self.segments: List[Optional[np.ndarray]] = [None] * n_steps
+        self.segment_bytes = 0
+        self.render_key: Optional[Hashable] = None
+        self.lock = threading.Lock()
+        self._recompute(0, n_steps)
+
+    @property
+    def width(self) -> int:
+        return self.pixels.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.pixels.nbytes + self.segment_bytes
+
+    def _drop_segment(self, step: int):
+        if self.segments[step] is not None:
+            self.segment_bytes -= self.segments[step].nbytes
+            self.segments[step] = None
+
+    def _recompute(self, first_step: int, stop_step: int):
+        # Regions start on a step boundary, so region-relative steps line up with the canvas
+        k = self.columns_per_step
+        region = Image.fromarray(self.pixels[:, first_step * k:min(stop_step * k, self.width)], 'RGBA')
+        timeline = self.process_fn(region, k)
+        for step in range(first_step, stop_step):
+            relative = step - first_step
+            self.step_notes[step] = timeline[relative] if relative < len(timeline) else _EMPTY_STEP
+            self.step_amplitudes[step] = timeline.column_amplitudes(relative) if relative < len(timeline) else None
+            self._drop_segment(step)
+
+    def apply_patch(self, x: int, y: int, patch: np.ndarray) -> int:
+        """Paste an RGBA patch with its top-left corner at (x, y), clipped to the canvas.
+        Returns the number of steps recomputed."""
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + patch.shape[1], self.width), min(y + patch.shape[0], self.height)
+        if x0 >= x1 or y0 >= y1:
+            return 0
+        self.pixels[y0:y1, x0:x1] = patch[y0 - y:y1 - y, x0 - x:x1 - x]
+        first_step, stop_step = x0 // self.columns_per_step, (x1 - 1) // self.columns_per_step + 1
+        self._recompute(first_step, stop_step)
+        return stop_step - first_step
+
+    def sounding_steps(self) -> int:
+        """Number of steps up to and including the last one with notes"""
+        for step in range(len(self.step_notes) - 1, -1, -1):
+            if len(self.step_notes[step]):
+                return step + 1
+        return 0
+
+    def timeline(self) -> Timeline:
+        steps = self.step_notes[:self.sounding_steps()]
+        if not steps:
+            return Timeline.empty()
+        lengths = [len(notes) for notes in steps]
+        amplitudes = None
+        if any(amps is not None for amps in self.step_amplitudes[:len(steps)]):
+            amplitudes = np.concatenate([amps for amps in self.step_amplitudes[:len(steps)] if amps is not None])
+        return Timeline.from_entries(np.repeat(np.arange(len(steps)), lengths), np.concatenate(steps), amplitudes)
+
+    def render(self, render_key: Hashable,
+               render_fn: Callable[[np.ndarray, Optional[np.ndarray]], np.ndarray]) -> Tuple[np.ndarray, int]:
+        """Concatenate per-step audio, rendering only steps without a cached segment.
+        ``render_fn(notes, amplitudes)`` renders one step. Returns (audio, number of reused segments)."""
+        if render_key != self.render_key:
+            self.segments = [None] * len(self.step_notes)
+            self.segment_bytes = 0
+            self.render_key = render_key
+        stop = self.sounding_steps()
+        reused = 0
+        for step in range(stop):
+            if self.segments[step] is None:
+                # float32 halves what every cached canvas holds on to
+                self.segments[step] = np.asarray(render_fn(self.step_notes[step], self.step_amplitudes[step]), dtype=np.float32)
+                self.segment_bytes += self.segments[step].nbytes
+            else:
+                reused += 1
+        if stop == 0:
+            return np.zeros(0, dtype=np.float32), 0
+        return np.concatenate(self.segments[:stop]), reused
+
+
+class CanvasStore:
+    """Thread-safe LRU of CanvasState objects keyed by an opaque canvas id
+
+    Bounded both in count and in bytes; states grow as their segments are rendered, so the
+    byte budget is checked again on every lookup. The most recent state is always kept.
+    """
+
+    def __init__(self, max_states: int = MAX_CANVAS_STATES, max_bytes: int = MAX_CANVAS_BYTES):
+        self.max_states = max_states
+        self.max_bytes = max_bytes
+        self._states: 'OrderedDict[str, CanvasState]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, canvas_id: Optional[str]) -> Optional[CanvasState]:
+        with self._lock:
+            state = self._states.get(canvas_id)
+            if state is not None:
+                self._states.move_to_end(canvas_id)
+                self._evict()
+            return state
+
+    def put(self, state: CanvasState, canvas_id: Optional[str] = None) -> str:
+        canvas_id = canvas_id or uuid.uuid4().hex
+        with self._lock:
+            self._states[canvas_id] = state
+            self._states.move_to_end(canvas_id)
+            self._evict()
+        return canvas_id
+
+    def _evict(self):
+        total = sum(state.nbytes for state in self._states.values())
+        while len(self._states) > 1 and (len(self._states) > self.max_states or total > self.max_bytes):
+            _, state = self._states.popitem(last=False)
+            total -= state.nbytes
@@ -0,0 +1,254 @@
+# Pluggable Color-to-Frequency Mapping Strategies
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from color_tables import ColorLookupTable, TABLES_ENABLED, pack_rgb, rgb_to_hsv_array, rgb_to_lab_array, table_signature
+
+DEFAULT_MAPPING = 'freq_symbols'
+
+
+class ColorMapping:
+    """A named color→frequency strategy behind one batch interface: map(rgb) -> freqs
+
+    ``batch_fn`` maps an (N, 3) RGB array to N frequencies. When a ColorLookupTable is
+    attached the strategy answers from the table instead, so KD-tree based mappings cost
+    one gather per color; closed-form rules are plain array math and need no table.
+    """
+
+    def __init__(self, name: str, batch_fn: Callable[[np.ndarray], np.ndarray],
+                 table: Optional[ColorLookupTable] = None, description: str = ''):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.table = table
+        self.description = description
+
+    def map(self, rgb) -> np.ndarray:
+        rgb = np.asarray(rgb)
+        if len(rgb) == 0:
+            return np.zeros(0)
+        if self.table is not None and TABLES_ENABLED:
+            return self.table.lookup(rgb)
+        return np.asarray(self.batch_fn(rgb), dtype=np.float64)
+
+
+COLOR_MAPPINGS: Dict[str, ColorMapping] = {}
+
+
+def register_mapping(name: str, batch_fn: Callable[[np.ndarray], np.ndarray],
+                     table: Optional[ColorLookupTable] = None, description: str = '') -> ColorMapping:
+    """Register (or replace) a strategy so requests can select it by name"""
+    mapping = ColorMapping(name, batch_fn, table=table, description=description)
+    COLOR_MAPPINGS[name] = mapping
+    return mapping
+
+
+def get_mapping(name: Optional[str] = None, default: str = DEFAULT_MAPPING) -> ColorMapping:
+    """Resolve a strategy by name, falling back to ``default`` when no name is given"""
+    name = name or default
+    if name not in COLOR_MAPPINGS:
+        raise ValueError(f"Unknown color mapping '{name}'. Available: {', '.join(sorted(COLOR_MAPPINGS))}")
+    return COLOR_MAPPINGS[name]
+
+
+def midi_to_frequency(midi_note) -> np.ndarray:
+    return 440.0 * 2.0 ** ((np.asarray(midi_note, dtype=np.float64) - 69) / 12.0)
+
+
+def chromatic_frequencies(rgb) -> np.ndarray:
+    """Vectorized color_to_frequency: hue picks one of 12 semitones, brightness the octave (3-6)"""
+    hue, _, value = rgb_to_hsv_array(rgb)
+    semitone = ((hue * 360) % 360 // 30).astype(np.int64)
+    octave = (3 + value * 3).astype(np.int64)
+    return midi_to_frequency(12 + octave * 12 + semitone)
+
+
+def hue_octave_frequencies(rgb, anchors: Optional[Dict[tuple, float]] = None) -> np.ndarray:
+    """Vectorized hue→note / brightness→octave rule, with exact anchor colors taking precedence"""
+    hue, _, value = rgb_to_hsv_array(rgb)
+    base_note_index = (hue * 12).astype(np.int64)
+    octave = (2 + value * 4).astype(np.int64)
+    midi_note = np.clip(12 * (octave + 1) + base_note_index, 21, 108)
+    frequencies = midi_to_frequency(midi_note)
+    if anchors:
+        anchor_keys = pack_rgb(np.array(list(anchors.keys())))
+        anchor_freqs = np.array(list(anchors.values()), dtype=np.float64)
+        order = np.argsort(anchor_keys)
+        anchor_keys, anchor_freqs = anchor_keys[order], anchor_freqs[order]
+        keys = pack_rgb(rgb)
+        slots = np.minimum(np.searchsorted(anchor_keys, keys), len(anchor_keys) - 1)
+        exact = anchor_keys[slots] == keys
+        frequencies[exact] = anchor_freqs[slots[exact]]
+    return frequencies
+
+
+def perceptual_nearest_frequencies(colors, frequencies) -> Callable[[np.ndarray], np.ndarray]:
+    """Batch fn giving each color the frequency of the perceptually nearest anchor (CIELAB ΔE76)"""
+    tree = cKDTree(rgb_to_lab_array(colors))
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+
+    def batch_fn(rgb):
+        _, indices = tree.query(rgb_to_lab_array(rgb), workers=-1)
+        return frequencies[indices]
+
+    return batch_fn
+
+
+def register_perceptual_mapping(name: str, colors, frequencies, description: str = '') -> ColorMapping:
+    """Register nearest-note matching in CIELAB, baked into an RGB table
+
+    Lab conversion only happens while the table is built; requests pay the same single
+    gather as the RGB-distance mappings.
+    """
+    batch_fn = perceptual_nearest_frequencies(colors, frequencies)
+    table = ColorLookupTable(name, batch_fn, table_signature(np.asarray(colors), np.asarray(frequencies), rule="cielab-nearest"))
+    return register_mapping(name, batch_fn, table=table, description=description)
+
+
+register_mapping(
+    'chromatic', chromatic_frequencies,
+    description="Hue selects one of 12 semitones, brightness selects octave 3-6"
+)
+
+
+# Frequency-to-color mapping: the color each piano key is painted with
+freq_symbols = {
+    "A0": {"frequency": 27.50, "color": [139, 0, 0], "range": [27.50, 29.14], "symbol": "♩"},
+    "A#0/Bb0": {"frequency": 29.14, "color": [255, 69, 0], "range": [29.14, 30.87], "symbol": "♯"},
+    "B0": {"frequency": 30.87, "color": [204, 204, 0], "range": [30.87, 32.70], "symbol": "♩"},
+    "C1": {"frequency": 32.70, "color": [102, 152, 0], "range": [32.70, 34.65], "symbol": "♩"},
+    "C#1/Db1": {"frequency": 34.65, "color": [0, 100, 0], "range": [34.65, 36.71], "symbol": "♯"},
+    "D1": {"frequency": 36.71, "color": [0, 50, 69], "range": [36.71, 38.89], "symbol": "♩"},
+    "D#1/Eb1": {"frequency": 38.89, "color": [0, 0, 139], "range": [38.89, 41.20], "symbol": "♯"},
+    "E1": {"frequency": 41.20, "color": [75, 0, 130], "range": [41.20, 43.65], "symbol": "♩"},
+    "F1": {"frequency": 43.65, "color": [112, 0, 171], "range": [43.65, 46.25], "symbol": "♩"},
+    "F#1/Gb1": {"frequency": 46.25, "color": [148, 0, 211], "range": [46.25, 49.00], "symbol": "♯"},
+    "G1": {"frequency": 49.00, "color": [157, 0, 106], "range": [49.00, 51.91], "symbol": "♩"},
+    "G#1/Ab1": {"frequency": 51.91, "color": [165, 0, 0], "range": [51.91, 55.00], "symbol": "♯"},
+    "A1": {"frequency": 55.00, "color": [210, 0, 128], "range": [55.00, 58.27], "symbol": "♩"},
+    "A#1/Bb1": {"frequency": 58.27, "color": [255, 94, 0], "range": [58.27, 61.74], "symbol": "♯"},
+    "B1": {"frequency": 61.74, "color": [221, 221, 0], "range": [61.74, 65.41], "symbol": "♩"},
+    "C2": {"frequency": 65.41, "color": [111, 175, 0], "range": [65.41, 69.30], "symbol": "♩"},
+    "C#2/Db2": {"frequency": 69.30, "color": [0, 128, 0], "range": [69.30, 73.42], "symbol": "♯"},
+    "D2": {"frequency": 73.42, "color": [0, 64, 85], "range": [73.42, 77.78], "symbol": "♩"},
+    "D#2/Eb2": {"frequency": 77.78, "color": [0, 0, 170], "range": [77.78, 82.41], "symbol": "♯"},
+    "E2": {"frequency": 82.41, "color": [92, 0, 159], "range": [82.41, 87.31], "symbol": "♩"},
+    "F2": {"frequency": 87.31, "color": [119, 0, 96], "range": [87.31, 92.50], "symbol": "♩"},
+    "F#2/Gb2": {"frequency": 92.50, "color": [159, 0, 226], "range": [92.50, 98.00], "symbol": "♯"},
+    "G2": {"frequency": 98.00, "color": [175, 0, 113], "range": [98.00, 103.83], "symbol": "♩"},
+    "G#2/Ab2": {"frequency": 103.83, "color": [191, 0, 0], "range": [103.83, 110.00], "symbol": "♯"},
+    "A2": {"frequency": 110.00, "color": [223, 59, 128], "range": [110.00, 116.54], "symbol": "♩"},
+    "A#2/Bb2": {"frequency": 116.54, "color": [255, 119, 0], "range": [116.54, 123.47], "symbol": "♯"},
+    "B2": {"frequency": 123.47, "color": [238, 238, 0], "range": [123.47, 130.81], "symbol": "♩"},
+    "C3": {"frequency": 130.81, "color": [119, 159, 0], "range": [130.81, 138.59], "symbol": "♩"},
+    "C#3/Db3": {"frequency": 138.59, "color": [0, 160, 0], "range": [138.59, 146.83], "symbol": "♯"},
+    "D3": {"frequency": 146.83, "color": [0, 80, 100], "range": [146.83, 155.56], "symbol": "♩"},
+    "D#3/Eb3": {"frequency": 155.56, "color": [0, 0, 200], "range": [155.56, 164.81], "symbol": "♯"},
+    "E3": {"frequency": 164.81, "color": [109, 0, 188], "range": [164.81, 174.61], "symbol": "♩"},
+    "F3": {"frequency": 174.61, "color": [140, 0, 215], "range": [174.61, 185.00], "symbol": "♩"},
+    "F#3/Gb3": {"frequency": 185.00, "color": [170, 0, 241], "range": [185.00, 196.00], "symbol": "♯"},
+    "G3": {"frequency": 196.00, "color": [194, 0, 121], "range": [196.00, 207.65], "symbol": "♩"},
+    "G#3/Ab3": {"frequency": 207.65, "color": [217, 0, 0], "range": [207.65, 220.00], "symbol": "♯"},
+    "A3": {"frequency": 220.00, "color": [236, 72, 0], "range": [220.00, 233.08], "symbol": "♩"},
+    "A#3/Bb3": {"frequency": 233.08, "color": [255, 144, 0], "range": [233.08, 246.94], "symbol": "♯"},
+    "B3": {"frequency": 246.94, "color": [255, 255, 0], "range": [246.94, 261.63], "symbol": "♩"},
+    "C4": {"frequency": 261.63, "color": [128, 224, 0], "range": [261.63, 277.18], "symbol": "♩"},
+    "C#4/Db4": {"frequency": 277.18, "color": [0, 192, 0], "range": [277.18, 293.66], "symbol": "♯"},
+    "D4": {"frequency": 293.66, "color": [0, 96, 115], "range": [293.66, 311.13], "symbol": "♩"},
+    "D#4/Eb4": {"frequency": 311.13, "color": [0, 0, 230], "range": [311.13, 329.63], "symbol": "♯"},
+    "E4": {"frequency": 329.63, "color": [126, 0, 217], "range": [329.63, 349.23], "symbol": "♩"},
+    "F4": {"frequency": 349.23, "color": [159, 26, 236], "range": [349.23, 369.99], "symbol": "♩"},
+    "F#4/Gb4": {"frequency": 369.99, "color": [191, 51, 255], "range": [369.99, 392.00], "symbol": "♯"},
+    "G4": {"frequency": 392.00, "color": [217, 26, 128], "range": [392.00, 415.30], "symbol": "♩"},
+    "G#4/Ab4": {"frequency": 415.30, "color": [243, 0, 0], "range": [415.30, 440.00], "symbol": "♯"},
+    "A4": {"frequency": 440.00, "color": [249, 85, 0], "range": [440.00, 466.16], "symbol": "♩"},
+    "A#4/Bb4": {"frequency": 466.16, "color": [255, 169, 0], "range": [466.16, 493.88], "symbol": "♯"},
+    "B4": {"frequency": 493.88, "color": [255, 255, 51], "range": [493.88, 523.25], "symbol": "♩"},
+    "C5": {"frequency": 523.25, "color": [153, 255, 51], "range": [523.25, 554.37], "symbol": "♩"},
+    "C#5/Db5": {"frequency": 554.37, "color": [51, 255, 51], "range": [554.37, 587.33], "symbol": "♯"},
+    "D5": {"frequency": 587.33, "color": [51, 204, 204], "range": [587.33, 622.25], "symbol": "♪"},
+    "D#5/Eb5": {"frequency": 622.25, "color": [51, 51, 255], "range": [622.25, 659.25], "symbol": "♭"},
+    "E5": {"frequency": 659.25, "color": [128, 51, 255], "range": [659.25, 698.46], "symbol": "𝅘𝅥𝅮"},
+    "F5": {"frequency": 698.46, "color": [159, 87, 255], "range": [698.46, 739.99], "symbol": "♩"},
+    "F#5/Gb5": {"frequency": 739.99, "color": [190, 123, 255], "range": [739.99, 783.99], "symbol": "♯"},
+    "G5": {"frequency": 783.99, "color": [204, 87, 128], "range": [783.99, 830.61], "symbol": "♫"},
+    "G#5/Ab5": {"frequency": 830.61, "color": [255, 51, 51], "range": [830.61, 880.00], "symbol": "♭"},
+    "A5": {"frequency": 880.00, "color": [255, 128, 102], "range": [880.00, 932.33], "symbol": "𝅗𝅥"},
+    "A#5/Bb5": {"frequency": 932.33, "color": [255, 204, 102], "range": [932.33, 987.77], "symbol": "♯"},
+    "B5": {"frequency": 987.77, "color": [255, 255, 102], "range": [987.77, 1046.50], "symbol": "𝅘𝅥"},
+    "C6": {"frequency": 1046.50, "color": [179, 255, 102], "range": [1046.50, 1108.73], "symbol": "♩"},
+    "C#6/Db6": {"frequency": 1108.73, "color": [102, 255, 102], "range": [1108.73, 1174.66], "symbol": "♯"},
+    "D6": {"frequency": 1174.66, "color": [102, 204, 204], "range": [1174.66, 1244.51], "symbol": "♪"},
+    "D#6/Eb6": {"frequency": 1244.51, "color": [102, 102, 255], "range": [1244.51, 1318.51], "symbol": "♭"},
+    "E6": {"frequency": 1318.51, "color": [153, 102, 255], "range": [1318.51, 1396.91], "symbol": "𝅘𝅥𝅮"},
+    "F6": {"frequency": 1396.91, "color": [171, 128, 255], "range": [1396.91, 1479.98], "symbol": "♩"},
+    "F#6/Gb6": {"frequency": 1479.98, "color": [201, 153, 255], "range": [1479.98, 1567.98], "symbol": "♯"},
+    "G6": {"frequency": 1567.98, "color": [209, 128, 153], "range": [1567.98, 1661.22], "symbol": "♫"},
+    "G#6/Ab6": {"frequency": 1661.22, "color": [255, 102, 102], "range": [1661.22, 1760.00], "symbol": "♭"},
+    "A6": {"frequency": 1760.00, "color": [255, 153, 128], "range": [1760.00, 1864.66], "symbol": "𝅗𝅥"},
+    "A#6/Bb6": {"frequency": 1864.66, "color": [255, 204, 153], "range": [1864.66, 1975.53], "symbol": "♯"},
+    "B6": {"frequency": 1975.53, "color": [255, 255, 153], "range": [1975.53, 2093.00], "symbol": "𝅘𝅥"},
+    "C7": {"frequency": 2093.00, "color": [204, 255, 153], "range": [2093.00, 2217.46], "symbol": "♩"},
+    "C#7/Db7": {"frequency": 2217.46, "color": [153, 255, 153], "range": [2217.46, 2349.32], "symbol": "♯"},
+    "D7": {"frequency": 2349.32, "color": [153, 204, 204], "range": [2349.32, 2489.02], "symbol": "♪"},
+    "D#7/Eb7": {"frequency": 2489.02, "color": [153, 153, 255], "range": [2489.02, 2637.02], "symbol": "♭"},
+    "E7": {"frequency": 2637.02, "color": [197, 153, 255], "range": [2637.02, 2793.83], "symbol": "𝅘𝅥𝅮"},
+    "F7": {"frequency": 2793.83, "color": [222, 176, 255], "range": [2793.83, 2959.96], "symbol": "♩"},
+    "F#7/Gb7": {"frequency": 2959.96, "color": [246, 198, 255], "range": [2959.96, 3135.96], "symbol": "♯"},
+    "G7": {"frequency": 3135.96, "color": [255, 176, 204], "range": [3135.96, 3322.44], "symbol": "♫"},
+    "G#7/Ab7": {"frequency": 3322.44, "color": [255, 153, 153], "range": [3322.44, 3520.00], "symbol": "♭"},
+    "A7": {"frequency": 3520.00, "color": [255, 194, 176], "range": [3520.00, 3729.31], "symbol": "𝅗𝅥"},
+    "A#7/Bb7": {"frequency": 3729.31, "color": [255, 234, 198], "range": [3729.31, 3951.07], "symbol": "♯"},
+    "B7": {"frequency": 3951.07, "color": [255, 255, 204], "range": [3951.07, 4186.01], "symbol": "𝅘𝅥"},
+    "C8": {"frequency": 4186.01, "color": [144, 238, 144], "range": [4186.01, 4434.92], "symbol": "♩"},
+}
+
+# Colors closer than this to a palette entry snap to its exact frequency
+EXACT_MATCH_DISTANCE = 15
+
+SYMBOL_COLORS = np.array([props["color"] for props in freq_symbols.values()])
+SYMBOL_FREQUENCIES = np.array([props["frequency"] for props in freq_symbols.values()])
+_symbol_hues = rgb_to_hsv_array(SYMBOL_COLORS)[0]
+_symbol_tree = cKDTree(SYMBOL_COLORS)
+
+
+def interpolate_frequency(color, nearest_index):
+    """Hue-adjusted frequency of the nearest palette entry (±5% by hue difference)
+
+    Accepts one color and index, or an (N, 3) array of colors with matching indices.
+    """
+    nearest_index = np.asarray(nearest_index)
+    base_freq = SYMBOL_FREQUENCIES[nearest_index]
+    hue_diff = np.abs(rgb_to_hsv_array(color)[0] - _symbol_hues[nearest_index])
+    hue_diff = np.minimum(hue_diff, 1 - hue_diff)  # Wrap around
+    frequency = base_freq * (1 + (hue_diff - 0.5) * 0.1)
+    return float(frequency) if np.ndim(frequency) == 0 else frequency
+
+
+def freq_symbol_frequencies(rgb) -> np.ndarray:
+    """Map an (N, 3) array of colors to freq_symbols frequencies with one KD-tree query"""
+    rgb = np.asarray(rgb, dtype=np.float64)
+    if len(rgb) == 0:
+        return np.zeros(0)
+    distances, indices = _symbol_tree.query(rgb, workers=-1)
+    freqs = SYMBOL_FREQUENCIES[indices].astype(np.float64)
+    far = distances >= EXACT_MATCH_DISTANCE
+    if np.any(far):
+        freqs[far] = interpolate_frequency(rgb[far], indices[far])
+    return freqs
+
+
+# One table file per host, whichever app builds it first
+register_mapping(
+    'freq_symbols', freq_symbol_frequencies,
+    table=ColorLookupTable(
+        'freq_symbols', freq_symbol_frequencies,
+        table_signature(SYMBOL_COLORS, SYMBOL_FREQUENCIES, rule=f"hue-interpolation:{EXACT_MATCH_DISTANCE}"),
+    ),
+    description="Nearest freq_symbols color, hue-interpolated when no color is close"
+)
+register_perceptual_mapping(
+    'perceptual', SYMBOL_COLORS, SYMBOL_FREQUENCIES,
+    description="Perceptually nearest freq_symbols color, matched in CIELAB"
+)
@@ -0,0 +1,201 @@
+# Precomputed RGB Lookup Tables for Color-to-Frequency Mapping
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: builds are not serialized across processes
+    fcntl = None
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Tables are written once per mapping and memory-mapped by every process on the host
+TABLE_DIR = os.getenv('COLOR_TABLE_DIR', os.path.join(tempfile.gettempdir(), 'color_tables'))
+RGB_CUBE_SIZE = 1 << 24
+BUILD_CHUNK_SIZE = 1 << 20
+# When disabled, callers fall back to batched KD-tree queries instead of table lookups
+TABLES_ENABLED = os.getenv('COLOR_TABLES_ENABLED', 'true').lower() == 'true'
+# Map tables at import time so every worker starts warm instead of on its first request
+PRELOAD_TABLES = os.getenv('COLOR_TABLES_PRELOAD', 'true').lower() == 'true'
+
+
+def pack_rgb(rgb) -> np.ndarray:
+    """Pack an (N, 3) array of RGB values into (r << 16 | g << 8 | b) uint32 keys"""
+    rgb = np.asarray(rgb, dtype=np.uint32)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+
+def unpack_rgb(keys) -> np.ndarray:
+    """Inverse of pack_rgb: uint32 keys back to an (N, 3) uint8 array"""
+    keys = np.asarray(keys, dtype=np.uint32)
+    return np.stack([(keys >> 16) & 0xFF, (keys >> 8) & 0xFF, keys & 0xFF], axis=-1).astype(np.uint8)
+
+
+def rgb_to_hsv_array(rgb) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized colorsys.rgb_to_hsv for 0-255 RGB rows, returning (h, s, v) arrays"""
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maxc = rgb.max(axis=-1)
+    minc = rgb.min(axis=-1)
+    span = maxc - minc
+    safe_span = np.where(span == 0, 1.0, span)
+    rc = (maxc - r) / safe_span
+    gc = (maxc - g) / safe_span
+    bc = (maxc - b) / safe_span
+    # Same branch priority as colorsys: red, then green, then blue
+    hue = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    hue = (hue / 6.0) % 1.0
+    hue = np.where(span == 0, 0.0, hue)
+    saturation = np.where(maxc == 0, 0.0, span / np.where(maxc == 0, 1.0, maxc))
+    return hue, saturation, maxc
+
+
+# sRGB (D65) to CIE XYZ, rows scaled by the reference white so XYZ/white is applied up front
+_SRGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+]) / np.array([[0.95047], [1.00000], [1.08883]])
+
+
+def rgb_to_lab_array(rgb) -> np.ndarray:
+    """Convert 0-255 sRGB rows to CIELAB (D65), returning an (..., 3) array of L*, a*, b*"""
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ _SRGB_TO_XYZ.T
+    delta = 6.0 / 29.0
+    f = np.where(xyz > delta ** 3, np.cbrt(xyz), xyz / (3 * delta ** 2) + 4.0 / 29.0)
+    lightness = 116.0 * f[..., 1] - 16.0
+    a = 500.0 * (f[..., 0] - f[..., 1])
+    b = 200.0 * (f[..., 1] - f[..., 2])
+    return np.stack([lightness, a, b], axis=-1)
+
+
+def map_unique_colors(rgb, map_fn: Callable[[np.ndarray], np.ndarray]) -> Tuple[np.ndarray, int]:
+    """Map each distinct color once and scatter the results back through the inverse index
+
+    Returns the per-pixel values and the number of unique colors that were mapped.
+    """
+    rgb = np.asarray(rgb)
+    if len(rgb) == 0:
+        return np.zeros(0), 0
+    unique_keys, inverse = np.unique(pack_rgb(rgb), return_inverse=True)
+    values = np.asarray(map_fn(unpack_rgb(unique_keys)))
+    return values[inverse.reshape(-1)], len(unique_keys)
+
+
+def table_signature(*arrays, rule: str = '') -> str:
+    """Short digest identifying the mapping a table was built from"""
+    digest = hashlib.sha1(rule.encode('utf-8'))
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str(array.dtype).encode('utf-8'))
+        digest.update(array.tobytes())
+    return digest.hexdigest()[:16]
+
+
+@contextmanager
+def _host_build_lock(path: str):
+    """Serialize table builds across all worker processes on the host"""
+    with open(f"{path}.lock", 'a') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class ColorLookupTable:
+    """Dense table covering the full 24-bit RGB cube, built once and memory-mapped from disk
+
+    ``build_fn`` receives an (N, 3) float array of colors and returns one value per color.
+    It is evaluated over the cube in chunks the first time the table is needed; the result
+    is persisted under TABLE_DIR so later processes only pay for an mmap.
+
+    The file is mapped read-only, so every gunicorn/uvicorn worker on a host shares the same
+    physical pages through the page cache, and only one of them ever builds it.
+    """
+
+    def __init__(self, name: str, build_fn: Callable[[np.ndarray], np.ndarray],
+                 signature: str, dtype=np.float32, table_dir: Optional[str] = None):
+        self.name = name
+        self.build_fn = build_fn
+        self.signature = signature
+        self.dtype = np.dtype(dtype)
+        self.table_dir = table_dir or TABLE_DIR
+        self._table = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.table_dir, f"{self.name}-{self.signature}.npy")
+
+    @property
+    def table(self) -> np.ndarray:
+        if self._table is None:
+            self.load()
+        return self._table
+
+    def load(self) -> np.ndarray:
+        """Memory-map the table, building it first if no file exists for this signature"""
+        with self._lock:
+            if self._table is not None:
+                return self._table
+            if not os.path.exists(self.path):
+                os.makedirs(self.table_dir, exist_ok=True)
+                with _host_build_lock(self.path):
+                    # Another worker may have finished the build while we waited
+                    if not os.path.exists(self.path):
+                        self.build()
+            self._table = np.load(self.path, mmap_mode='r')
+            logger.info(f"Color table '{self.name}' mapped from {self.path}")
+            return self._table
+
+    def build(self):
+        """Evaluate build_fn over the whole RGB cube and write the table atomically"""
+        start_time = time.time()
+        os.makedirs(self.table_dir, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=self.dtype, shape=(RGB_CUBE_SIZE,))
+        try:
+            for start in range(0, RGB_CUBE_SIZE, BUILD_CHUNK_SIZE):
+                keys = np.arange(start, start + BUILD_CHUNK_SIZE, dtype=np.uint32)
+                out[start:start + BUILD_CHUNK_SIZE] = self.build_fn(unpack_rgb(keys).astype(np.float64))
+            out.flush()
+            del out
+            # Concurrent builders race harmlessly: every file for a signature is identical
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        logger.info(f"Built color table '{self.name}' in {time.time() - start_time:.2f}s")
+
+    @property
+    def loaded(self) -> bool:
+        return self._table is not None
+
+    def lookup(self, rgb) -> np.ndarray:
+        """Map an (N, 3) array of RGB values with a single fancy-indexing operation"""
+        return self.table[pack_rgb(rgb)]
+
+    def lookup_one(self, r: int, g: int, b: int):
+        return self.table[(int(r) << 16) | (int(g) << 8) | int(b)]
+
+
+def attach_tables(*tables: ColorLookupTable):
+    """Map tables at process start (a no-op when preloading or tables are disabled)"""
+    if not (TABLES_ENABLED and PRELOAD_TABLES):
+        return
+    for table in tables:
+        table.load()
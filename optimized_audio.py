@@ -3,15 +3,124 @@ import numpy as np
 from scipy.spatial import cKDTree
 from scipy import signal
 from PIL import Image
-import colorsys
 from functools import lru_cache
 import logging
+import threading
+import itertools
+import weakref
 from typing import Dict, List, Tuple, Optional
 import time
+from color_tables import ColorLookupTable, TABLES_ENABLED, map_unique_colors, rgb_to_hsv_array, table_signature
+from color_mappings import COLOR_MAPPINGS, get_mapping, register_mapping
+from timeline import Timeline, build_column_timeline, crop_to_painted, parse_flag, resolve_columns_per_step
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Colors closer than this to a palette entry snap to its exact frequency
+EXACT_MATCH_DISTANCE = 15
+# Set on note-table entries whose color needs interpolation instead of an exact match
+INTERPOLATE_FLAG = 0x80
+NOTE_INDEX_MASK = 0x7F
+TEMPERAMENTS = ('equal', 'just', 'pythagorean')
+# Seconds of audio per timeline step, used to turn a requested duration into column binning
+DURATION_PER_STEP = 60 / 1000
+
+# Simplified just intonation ratios
+JUST_INTONATION_RATIOS = {
+    261.63: 1.0,    # C4
+    293.66: 9/8,    # D4
+    329.63: 5/4,    # E4
+    349.23: 4/3,    # F4
+    392.00: 3/2,    # G4
+    440.00: 5/3,    # A4
+    493.88: 15/8    # B4
+}
+
+# Simplified Pythagorean ratios based on perfect fifths
+PYTHAGOREAN_RATIOS = {
+    261.63: 1.0,    # C4
+    293.66: 256/243, # D4
+    329.63: 64/81,   # E4
+    349.23: 4/3,    # F4
+    392.00: 3/2,    # G4
+    440.00: 128/81, # A4
+    493.88: 16/9    # B4
+}
+
+class TemperamentTable:
+    """Per-note tuning for one temperament, compiled once at startup"""
+    
+    def __init__(self, name: str, ratios: np.ndarray, frequencies: np.ndarray):
+        self.name = name
+        self.ratios = ratios
+        # Base frequency that interpolated colors scale from under this temperament
+        self.interpolation_base = frequencies * ratios
+
+class _ThreadOwner:
+    """Lives in a thread's locals only, so it is collected when the thread exits"""
+
+class ProcessingStats:
+    """Per-thread counters that are only summed when read
+    
+    Each thread increments its own dict, so the hot path never takes a lock;
+    the registry lock is touched once per thread on its first increment and
+    once when the thread exits, when its counts are folded into a retired total.
+    """
+    
+    COUNTERS = (
+        'total_lookups', 'exact_matches', 'interpolated_lookups',
+        'pixels_mapped', 'unique_colors', 'columns_generated',
+        'images_processed', 'processing_seconds'
+    )
+    
+    def __init__(self):
+        self._local = threading.local()
+        self._registry: Dict[int, Dict[str, float]] = {}
+        self._registry_keys = itertools.count()
+        self._registry_lock = threading.Lock()
+        self._retired = dict.fromkeys(self.COUNTERS, 0)
+        self._baseline = dict.fromkeys(self.COUNTERS, 0)
+    
+    def _counters(self) -> Dict[str, float]:
+        counters = getattr(self._local, 'counters', None)
+        if counters is None:
+            counters = dict.fromkeys(self.COUNTERS, 0)
+            owner = _ThreadOwner()
+            with self._registry_lock:
+                key = next(self._registry_keys)
+                self._registry[key] = counters
+            # Thread-per-request servers would otherwise grow the registry forever
+            weakref.finalize(owner, self._retire, key)
+            self._local.owner = owner
+            self._local.counters = counters
+        return counters
+    
+    def _retire(self, key: int):
+        with self._registry_lock:
+            counters = self._registry.pop(key)
+            for name in self.COUNTERS:
+                self._retired[name] += counters[name]
+    
+    def add(self, name: str, amount=1):
+        self._counters()[name] += amount
+    
+    def _totals(self) -> Dict[str, float]:
+        with self._registry_lock:
+            return {
+                name: self._retired[name] + sum(counters[name] for counters in self._registry.values())
+                for name in self.COUNTERS
+            }
+    
+    def snapshot(self) -> Dict[str, float]:
+        """Aggregate every thread's counters, relative to the last reset"""
+        totals = self._totals()
+        return {name: totals[name] - self._baseline[name] for name in self.COUNTERS}
+    
+    def reset(self):
+        # Rebasing instead of zeroing keeps writers lock-free
+        self._baseline = self._totals()
+
 class AdvancedColorProcessor:
     """High-performance color-to-frequency conversion with advanced features"""
     
@@ -130,14 +239,32 @@ class AdvancedColorProcessor:
         self.frequencies = np.array(list(self.color_map.values()))
         
         # Pre-compute color statistics for better interpolation
-        self.color_hsv = np.array([colorsys.rgb_to_hsv(*(c/255 for c in color)) for color in self.colors])
+        self.color_hsv = np.stack(rgb_to_hsv_array(self.colors), axis=-1)
+        
+        # Nearest-note index for every 24-bit color, flagged where interpolation applies.
+        # Independent of temperament and sensitivity, so one table serves every setting.
+        self.note_table = ColorLookupTable(
+            "advanced_color_map",
+            self._note_table_chunk,
+            table_signature(self.colors, rule=f"nearest-note:{EXACT_MATCH_DISTANCE}"),
+            dtype=np.uint8,
+        )
         
         logger.info(f"Color tree initialized with {len(self.color_map)} colors")
     
+    def _note_table_chunk(self, rgb: np.ndarray) -> np.ndarray:
+        """Nearest palette index per color, with INTERPOLATE_FLAG set beyond the snap distance"""
+        distances, indices = self.color_tree.query(rgb)
+        codes = indices.astype(np.uint8)
+        codes[distances >= EXACT_MATCH_DISTANCE] |= INTERPOLATE_FLAG
+        return codes
+    
     def setup_advanced_features(self):
         """Setup advanced processing features"""
-        # Musical temperament settings
-        self.temperament = 'equal'  # 'equal', 'just', 'pythagorean'
+        # Musical temperament settings: every temperament is compiled up front so
+        # switching is a single reference swap ('equal', 'just', 'pythagorean')
+        self.temperament_tables = {name: self.compile_temperament_table(name) for name in TEMPERAMENTS}
+        self.active_temperament = self.temperament_tables['equal']
         self.harmonic_weights = [1.0, 0.5, 0.25, 0.125]  # Harmonic series weights
         
         # Color sensitivity settings
@@ -148,45 +275,71 @@ class AdvancedColorProcessor:
         }
         
         # Performance metrics
-        self.processing_stats = {
-            'cache_hits': 0,
-            'cache_misses': 0,
-            'total_lookups': 0
-        }
+        self.processing_stats = ProcessingStats()
+    
+    @property
+    def temperament(self) -> str:
+        return self.active_temperament.name
+    
+    def compile_temperament_table(self, temperament: str) -> TemperamentTable:
+        """Precompute the tuning ratio of every palette note for a temperament"""
+        if temperament == 'just':
+            ratios = np.asarray(self.get_just_intonation_ratio(self.frequencies))
+        elif temperament == 'pythagorean':
+            ratios = np.asarray(self.get_pythagorean_ratio(self.frequencies))
+        else:
+            ratios = np.ones(len(self.frequencies))
+        return TemperamentTable(temperament, ratios, self.frequencies)
     
-    @lru_cache(maxsize=2000)
     def get_frequency_fast(self, r: int, g: int, b: int) -> float:
-        """O(log n) color lookup using KD-Tree with caching"""
-        self.processing_stats['total_lookups'] += 1
+        """O(1) color lookup using the precomputed note table with caching"""
+        # The active temperament and sensitivity are part of the cache key, so
+        # switching either never serves results computed under the old setting
+        return self._get_frequency_cached(
+            int(r), int(g), int(b),
+            self.active_temperament,
+            tuple(self.color_sensitivity.values())
+        )
+    
+    @lru_cache(maxsize=2000)
+    def _get_frequency_cached(self, r: int, g: int, b: int,
+                              temperament: TemperamentTable, sensitivity: Tuple[float, ...]) -> float:
+        self.processing_stats.add('total_lookups')
         
-        color_array = np.array([r, g, b])
-        distance, index = self.color_tree.query(color_array)
+        code = int(self.note_table.lookup_one(r, g, b))
+        index = code & NOTE_INDEX_MASK
         
         # Use exact match if very close
-        if distance < 15:  # Threshold for "exact" match
-            self.processing_stats['cache_hits'] += 1
+        if not code & INTERPOLATE_FLAG:
+            self.processing_stats.add('exact_matches')
             return float(self.frequencies[index])
         
         # Interpolate for smoother transitions
-        self.processing_stats['cache_misses'] += 1
-        return self.interpolate_frequency_advanced(color_array, index, distance)
+        self.processing_stats.add('interpolated_lookups')
+        color_array = np.array([r, g, b])
+        distance = float(np.linalg.norm(color_array - self.colors[index]))
+        return self.interpolate_frequency_advanced(color_array, index, distance, temperament)
     
-    def interpolate_frequency_advanced(self, color: np.ndarray, nearest_index: int, distance: float) -> float:
-        """Advanced frequency interpolation with multiple factors"""
+    def interpolate_frequency_advanced(self, color: np.ndarray, nearest_index, distance: Optional[float] = None,
+                                       temperament: Optional[TemperamentTable] = None):
+        """Advanced frequency interpolation with multiple factors
+
+        Accepts one color and index, or an (N, 3) array of colors with matching indices.
+        """
+        temperament = temperament or self.active_temperament
+        nearest_index = np.asarray(nearest_index)
+        base_freq = self.frequencies[nearest_index].astype(np.float64)
         if not self.enable_interpolation:
-            return float(self.frequencies[nearest_index])
-        
-        base_freq = self.frequencies[nearest_index]
-        nearest_color = self.colors[nearest_index]
+            return float(base_freq) if base_freq.ndim == 0 else base_freq
         
         # Calculate color differences in HSV space
-        input_hsv = colorsys.rgb_to_hsv(*(color/255))
+        input_hue, input_sat, input_val = rgb_to_hsv_array(color)
         nearest_hsv = self.color_hsv[nearest_index]
         
         # Weighted interpolation based on color sensitivity
-        hue_diff = abs(input_hsv[0] - nearest_hsv[0])
-        sat_diff = abs(input_hsv[1] - nearest_hsv[1])
-        val_diff = abs(input_hsv[2] - nearest_hsv[2])
+        hue_diff = np.abs(input_hue - nearest_hsv[..., 0])
+        sat_diff = np.abs(input_sat - nearest_hsv[..., 1])
+        val_diff = np.abs(input_val - nearest_hsv[..., 2])
         
         # Apply sensitivity weights
         weighted_diff = (
@@ -198,53 +351,83 @@ class AdvancedColorProcessor:
         # Frequency adjustment based on color difference
         freq_multiplier = 1 + (weighted_diff - 0.5) * 0.2  # ±10% variation
         
-        # Apply temperament-based adjustment
-        if self.temperament == 'just':
-            freq_multiplier *= self.get_just_intonation_ratio(base_freq)
-        elif self.temperament == 'pythagorean':
-            freq_multiplier *= self.get_pythagorean_ratio(base_freq)
-        
-        return float(base_freq * freq_multiplier)
+        # Temperament-based adjustment comes from the precompiled table
+        frequency = temperament.interpolation_base[nearest_index] * freq_multiplier
+        return float(frequency) if frequency.ndim == 0 else frequency
+    
+    def map_colors_batch(self, rgb: np.ndarray) -> np.ndarray:
+        """Map an (N, 3) array of colors with one KD-tree query and array interpolation"""
+        rgb = np.asarray(rgb, dtype=np.float64)
+        if len(rgb) == 0:
+            return np.zeros(0)
+        distances, indices = self.color_tree.query(rgb, workers=-1)
+        frequencies = self.frequencies[indices].astype(np.float64)
+        
+        far = distances >= EXACT_MATCH_DISTANCE
+        if np.any(far):
+            frequencies[far] = self.interpolate_frequency_advanced(rgb[far], indices[far])
+        
+        self._record_lookups(len(rgb), int(np.count_nonzero(far)))
+        return frequencies
+    
+    def map_colors(self, rgb: np.ndarray) -> np.ndarray:
+        """Map an (N, 3) array of colors, preferring the precomputed note table"""
+        if not TABLES_ENABLED:
+            return self.map_colors_batch(rgb)
+        
+        codes = self.note_table.lookup(rgb)
+        indices = codes & NOTE_INDEX_MASK
+        frequencies = self.frequencies[indices].astype(np.float64)
+        
+        # Only colors away from every palette entry need the interpolation rule
+        far = (codes & INTERPOLATE_FLAG) != 0
+        if np.any(far):
+            frequencies[far] = self.interpolate_frequency_advanced(np.asarray(rgb)[far], indices[far])
+        
+        self._record_lookups(len(codes), int(np.count_nonzero(far)))
+        return frequencies
+    
+    def _record_lookups(self, total: int, interpolated: int):
+        self.processing_stats.add('total_lookups', total)
+        self.processing_stats.add('exact_matches', total - interpolated)
+        self.processing_stats.add('interpolated_lookups', interpolated)
     
     def get_just_intonation_ratio(self, freq: float) -> float:
         """Get just intonation ratio for frequency"""
-        # Simplified just intonation ratios
-        ratios = {
-            261.63: 1.0,    # C4
-            293.66: 9/8,    # D4
-            329.63: 5/4,    # E4
-            349.23: 4/3,    # F4
-            392.00: 3/2,    # G4
-            440.00: 5/3,    # A4
-            493.88: 15/8    # B4
-        }
-        
         # Find closest frequency and apply ratio
-        closest_freq = min(ratios.keys(), key=lambda x: abs(x - freq))
-        return ratios.get(closest_freq, 1.0)
+        return self._closest_ratio(JUST_INTONATION_RATIOS, freq)
     
     def get_pythagorean_ratio(self, freq: float) -> float:
         """Get Pythagorean tuning ratio for frequency"""
-        # Simplified Pythagorean ratios based on perfect fifths
-        ratios = {
-            261.63: 1.0,    # C4
-            293.66: 256/243, # D4
-            329.63: 64/81,   # E4
-            349.23: 4/3,    # F4
-            392.00: 3/2,    # G4
-            440.00: 128/81, # A4
-            493.88: 16/9    # B4
-        }
-        
-        closest_freq = min(ratios.keys(), key=lambda x: abs(x - freq))
-        return ratios.get(closest_freq, 1.0)
+        return self._closest_ratio(PYTHAGOREAN_RATIOS, freq)
     
-    def process_image_optimized(self, image_data) -> Dict[int, List[float]]:
-        """High-performance image processing with vectorized operations"""
+    @staticmethod
+    def _closest_ratio(ratios: Dict[float, float], freq):
+        """Ratio of the reference pitch closest to each frequency (scalar or array)"""
+        reference = np.array(list(ratios.keys()))
+        values = np.array(list(ratios.values()))
+        closest = np.abs(np.asarray(freq, dtype=np.float64)[..., None] - reference).argmin(axis=-1)
+        ratio = values[closest]
+        return float(ratio) if ratio.ndim == 0 else ratio
+    
+    def process_image_optimized(self, image_data, mapping: Optional[str] = None,
+                                columns_per_step: int = 1, weighted: bool = False) -> Timeline:
+        """High-performance image processing with vectorized operations
+        
+        ``mapping`` selects a registered color mapping; by default this processor's own map is used.
+        ``columns_per_step`` bins that many adjacent pixel columns into each timeline step.
+        ``weighted`` gives each note its coverage of the step (painted pixels over image
+        height x columns_per_step) as amplitude.
+        """
         start_time = time.time()
         
-        # Load and convert image
+        # Load and convert image, cropped to the region that can actually sound
         img = Image.open(image_data).convert('RGBA')
+        canvas_height = img.height
+        img, x_offset = crop_to_painted(img)
+        if img is None:
+            logger.warning("No valid pixels found in image")
+            return Timeline.empty()
         img_array = np.array(img)
         width, height = img.size
         
@@ -261,51 +444,38 @@ class AdvancedColorProcessor:
         
         if len(valid_pixels) == 0:
             logger.warning("No valid pixels found in image")
-            return {}
+            return Timeline.empty()
         
-        # Batch process colors with vectorized operations
+        # Map each distinct color once and scatter back to every valid pixel
         rgb_pixels = valid_pixels[:, :3]
-        frequencies = np.array([
-            self.get_frequency_fast(int(r), int(g), int(b))
-            for r, g, b in rgb_pixels
-        ])
-        
-        # Filter out zero frequencies
-        non_zero_mask = frequencies > 0
-        valid_frequencies = frequencies[non_zero_mask]
-        valid_indices = np.where(valid_mask)[0][non_zero_mask]
+        map_fn = self.map_colors if mapping is None else get_mapping(mapping).map
+        frequencies, unique_colors = map_unique_colors(rgb_pixels, map_fn)
+        self.processing_stats.add('pixels_mapped', len(rgb_pixels))
+        self.processing_stats.add('unique_colors', unique_colors)
+        
+        # Group by column; zero frequencies are dropped while building the timeline
+        timeline = build_column_timeline(
+            np.flatnonzero(valid_mask) % width + x_offset, frequencies, columns_per_step, weighted,
+            step_capacity=canvas_height * columns_per_step
+        )
         
-        if len(valid_frequencies) == 0:
+        if not timeline:
             logger.warning("No valid frequencies generated")
-            return {}
-        
-        # Create timeline based on x-coordinates
-        timeline = {}
-        
-        for i, pixel_index in enumerate(valid_indices):
-            x_coord = pixel_index % width
-            if x_coord not in timeline:
-                timeline[x_coord] = []
-            
-            freq = valid_frequencies[i]
-            if freq > 0:
-                timeline[x_coord].append(freq)
-        
-        # Remove duplicates and sort frequencies for each column
-        for x in timeline:
-            # Use numpy for efficient unique and sort
-            unique_freqs = np.unique(timeline[x])
-            timeline[x] = unique_freqs.tolist()
+            return timeline
         
         processing_time = time.time() - start_time
-        logger.info(f"Processed {len(valid_pixels)} pixels in {processing_time:.3f}s")
-        logger.info(f"Generated timeline with {len(timeline)} columns")
+        self.processing_stats.add('images_processed')
+        self.processing_stats.add('columns_generated', timeline.non_silent_columns)
+        self.processing_stats.add('processing_seconds', processing_time)
+        logger.info(f"Processed {len(valid_pixels)} pixels ({unique_colors} unique colors) in {processing_time:.3f}s")
+        logger.info(f"Generated timeline with {timeline.non_silent_columns} columns ({timeline.nbytes} bytes)")
         
         return timeline
     
-    def process_image_advanced(self, image_data, brush_type: str = 'round') -> Dict[int, List[float]]:
+    def process_image_advanced(self, image_data, brush_type: str = 'round', mapping: Optional[str] = None,
+                               columns_per_step: int = 1, weighted: bool = False) -> Timeline:
         """Advanced image processing with brush-specific optimizations"""
-        timeline = self.process_image_optimized(image_data)
+        timeline = self.process_image_optimized(image_data, mapping, columns_per_step, weighted)
         
         # Apply brush-specific frequency modifications
         if brush_type in ['star', 'spray', 'cross']:
@@ -313,64 +483,81 @@ class AdvancedColorProcessor:
         
         return timeline
     
-    def add_harmonics_to_timeline(self, timeline: Dict[int, List[float]], brush_type: str) -> Dict[int, List[float]]:
-        """Add harmonics based on brush type"""
-        enhanced_timeline = {}
-        
-        for x, frequencies in timeline.items():
-            enhanced_freqs = frequencies.copy()
-            
-            for freq in frequencies:
-                if brush_type == 'star':
-                    # Add harmonic series
-                    for i, weight in enumerate(self.harmonic_weights[1:], 1):
-                        harmonic_freq = freq * (i + 1)
-                        if harmonic_freq < 20000:  # Audio range limit
-                            enhanced_freqs.append(harmonic_freq * weight)
-                
-                elif brush_type == 'spray':
-                    # Add noise-like frequencies
-                    noise_freq = freq * (1 + np.random.uniform(-0.1, 0.1))
-                    enhanced_freqs.append(noise_freq)
-                
-                elif brush_type == 'cross':
-                    # Add frequency modulation
-                    mod_freq = freq * 1.5
-                    enhanced_freqs.append(mod_freq)
-            
-            enhanced_timeline[x] = np.unique(enhanced_freqs).tolist()
-        
-        return enhanced_timeline
+    def add_harmonics_to_timeline(self, timeline: Timeline, brush_type: str) -> Timeline:
+        """Add harmonics based on brush type
+
+        In weighted timelines each added note inherits its source note's amplitude.
+        """
+        columns = timeline.column_index()
+        frequencies = timeline.notes.astype(np.float64)
+        amplitudes = timeline.amplitudes
+        enhanced_columns = [columns]
+        enhanced_freqs = [frequencies]
+        enhanced_amps = [amplitudes]
+        
+        if brush_type == 'star':
+            # Add harmonic series
+            for i, weight in enumerate(self.harmonic_weights[1:], 1):
+                harmonic_freqs = frequencies * (i + 1)
+                in_range = harmonic_freqs < 20000  # Audio range limit
+                enhanced_columns.append(columns[in_range])
+                enhanced_freqs.append(harmonic_freqs[in_range] * weight)
+                enhanced_amps.append(None if amplitudes is None else amplitudes[in_range])
+        
+        elif brush_type == 'spray':
+            # Add noise-like frequencies
+            enhanced_columns.append(columns)
+            enhanced_freqs.append(frequencies * (1 + np.random.uniform(-0.1, 0.1, len(frequencies))))
+            enhanced_amps.append(amplitudes)
+        
+        elif brush_type == 'cross':
+            # Add frequency modulation
+            enhanced_columns.append(columns)
+            enhanced_freqs.append(frequencies * 1.5)
+            enhanced_amps.append(amplitudes)
+        
+        if amplitudes is None:
+            return build_column_timeline(np.concatenate(enhanced_columns), np.concatenate(enhanced_freqs))
+        # Weights are amplitudes already; notes that land on one frequency add up
+        return build_column_timeline(
+            np.concatenate(enhanced_columns), np.concatenate(enhanced_freqs),
+            weighted=True, weights=np.concatenate(enhanced_amps), step_capacity=1
+        )
     
     def get_processing_stats(self) -> Dict[str, any]:
         """Get performance statistics"""
-        total = self.processing_stats['total_lookups']
-        if total > 0:
-            cache_hit_rate = (self.processing_stats['cache_hits'] / total) * 100
-        else:
-            cache_hit_rate = 0
+        stats = self.processing_stats.snapshot()
+        
+        # Real LRU behaviour of get_frequency_fast, not the exact/interpolated split
+        cache_info = self._get_frequency_cached.cache_info()
+        cache_requests = cache_info.hits + cache_info.misses
+        cache_hit_rate = (cache_info.hits / cache_requests) * 100 if cache_requests > 0 else 0
         
+        busy = stats['processing_seconds']
         return {
-            **self.processing_stats,
+            **stats,
+            'processing_seconds': round(busy, 3),
+            'pixels_per_second': round(stats['pixels_mapped'] / busy) if busy > 0 else 0,
+            'columns_per_second': round(stats['columns_generated'] / busy) if busy > 0 else 0,
+            'cache_hits': cache_info.hits,
+            'cache_misses': cache_info.misses,
+            'cache_entries': cache_info.currsize,
             'cache_hit_rate': f"{cache_hit_rate:.2f}%",
+            'note_table_loaded': self.note_table.loaded,
             'colors_in_tree': len(self.color_map),
             'temperament': self.temperament
         }
     
     def reset_stats(self):
         """Reset performance statistics"""
-        self.processing_stats = {
-            'cache_hits': 0,
-            'cache_misses': 0,
-            'total_lookups': 0
-        }
-        self.get_frequency_fast.cache_clear()
+        self.processing_stats.reset()
+        self._get_frequency_cached.cache_clear()
         logger.info("Performance statistics reset")
     
     def set_temperament(self, temperament: str):
         """Set musical temperament"""
-        if temperament in ['equal', 'just', 'pythagorean']:
-            self.temperament = temperament
+        if temperament in self.temperament_tables:
+            self.active_temperament = self.temperament_tables[temperament]
             logger.info(f"Temperament set to {temperament}")
         else:
             logger.warning(f"Unknown temperament: {temperament}")
@@ -385,16 +572,23 @@ class AdvancedColorProcessor:
         logger.info(f"Color sensitivity updated: {self.color_sensitivity}")
 
 # Global instance for easy access
+# The note table is mapped (or built) on the first lookup, not at import
 advanced_processor = AdvancedColorProcessor()
 
+register_mapping(
+    'advanced', advanced_processor.map_colors,
+    description="88-key color map with sensitivity-weighted interpolation and temperament tuning"
+)
+
 # Integration helper functions
 def get_optimized_frequency(r: int, g: int, b: int) -> float:
     """Convenience function for frequency lookup"""
     return advanced_processor.get_frequency_fast(r, g, b)
 
-def process_image_for_audio(image_data, brush_type: str = 'round') -> Dict[int, List[float]]:
+def process_image_for_audio(image_data, brush_type: str = 'round', mapping: Optional[str] = None,
+                            columns_per_step: int = 1, weighted: bool = False) -> Timeline:
     """Convenience function for image processing"""
-    return advanced_processor.process_image_advanced(image_data, brush_type)
+    return advanced_processor.process_image_advanced(image_data, brush_type, mapping, columns_per_step, weighted)
 
 def get_audio_processor_stats() -> Dict[str, any]:
     """Get processor performance statistics"""
@@ -419,12 +613,30 @@ def submit_optimized():
             return jsonify({"error": "No image provided"}), 400
         
         brush = request.json.get('brush', 'round')
+        mapping = request.json.get('mapping', 'advanced')
+        weighted = parse_flag(request.json.get('weighted', False))
+        if mapping not in COLOR_MAPPINGS:
+            return jsonify({"error": f"Invalid mapping: {mapping}. Valid options are {sorted(COLOR_MAPPINGS)}"}), 400
         image_data = request.json['image'].split(',')[1]
+        image_stream = BytesIO(base64.b64decode(image_data))
+        
+        # Only the header is read here; the stream is rewound for processing
+        try:
+            columns_per_step = resolve_columns_per_step(
+                Image.open(image_stream).width, DURATION_PER_STEP,
+                request.json.get('columns_per_step'), request.json.get('duration')
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid time resolution: {str(e)}"}), 400
+        image_stream.seek(0)
         
         # Process image with advanced optimization
         timeline = advanced_processor.process_image_advanced(
-            BytesIO(base64.b64decode(image_data)), 
-            brush
+            image_stream, 
+            brush,
+            mapping,
+            columns_per_step,
+            weighted
         )
         
         if not timeline:
@@ -439,7 +651,9 @@ def submit_optimized():
         return jsonify({
             "success": True,
             "processing_time": f"{processing_time:.3f}s",
-            "timeline_columns": len(timeline),
+            "timeline_columns": timeline.non_silent_columns,
+            "columns_per_step": columns_per_step,
+            "timeline": timeline.to_json(),
             "processor_stats": stats,
             "message": "Advanced processing completed successfully"
         })
@@ -506,15 +720,19 @@ def generate_performance_recommendations(stats: Dict[str, any]) -> List[str]:
     recommendations = []
     
     cache_hit_rate = float(stats.get('cache_hit_rate', '0%').rstrip('%'))
+    cache_requests = stats.get('cache_hits', 0) + stats.get('cache_misses', 0)
     
-    if cache_hit_rate < 50:
+    if cache_requests > 0 and cache_hit_rate < 50:
         recommendations.append("Consider increasing cache size for better performance")
     
     if stats.get('total_lookups', 0) > 10000:
         recommendations.append("High usage detected - consider enabling parallel processing")
     
-    if stats.get('cache_misses', 0) > stats.get('cache_hits', 0):
-        recommendations.append("Many cache misses - try adjusting color sensitivity weights")
+    if stats.get('interpolated_lookups', 0) > stats.get('exact_matches', 0):
+        recommendations.append("Most colors are interpolated - try adjusting color sensitivity weights")
+    
+    if not stats.get('note_table_loaded', True):
+        recommendations.append("Note table not mapped yet - the first color lookup maps it, building it if no worker has")
     
     if not recommendations:
         recommendations.append("Performance is optimal")
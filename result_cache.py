@@ -0,0 +1,76 @@
+# Content-Addressed Cache of Rendered Results
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Bytes of rendered files the cache answers with; the least recently used results are forgotten first
+RESULT_CACHE_BYTES = int(os.getenv('RESULT_CACHE_BYTES', 256 * 1024 * 1024))
+
+
+def result_key(pixels: np.ndarray, **config) -> str:
+    """Hash decoded pixels together with every setting that shapes the rendered output"""
+    pixels = np.ascontiguousarray(pixels)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([pixels.shape, str(pixels.dtype), config], sort_keys=True, default=str).encode('utf-8'))
+    digest.update(pixels.data)
+    return digest.hexdigest()
+
+
+def seed_for(key: str) -> int:
+    """Noise seed for a render, so the same key always renders to the same audio"""
+    return int(key[:16], 16)
+
+
+class ResultCache:
+    """Byte-bounded LRU from result keys to files already written in ``directory``
+
+    Entries map to the JSON result that was returned for them. Evicting an entry only drops
+    it from the index: its files were handed out to clients (and may be recorded elsewhere),
+    so the cache never deletes them.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = RESULT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not all(os.path.exists(os.path.join(self.directory, f)) for f in entry[0]):
+                # Removed behind our back; forget it and render again
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, key: str, filenames: List[str], result: Dict):
+        size = sum(os.path.getsize(os.path.join(self.directory, f)) for f in filenames)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (list(filenames), dict(result), size)
+            self.total_bytes += size
+            # Never evict the entry just added, even if it alone exceeds the budget
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: str):
+        self.total_bytes -= self._entries.pop(key)[2]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.total_bytes, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,86 @@
+# Process-wide Cache of Rendered Step Segments
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+# Bytes of rendered segments kept in memory per process; least recently used go first
+SEGMENT_CACHE_BYTES = int(os.getenv('SEGMENT_CACHE_BYTES', 64 * 1024 * 1024))
+
+
+def segment_key(notes, amplitudes=None, **params) -> bytes:
+    """Canonical key for one step: its sorted note set, per-note gains and synthesis settings"""
+    notes = np.asarray(notes, dtype=np.float32)
+    order = np.argsort(notes, kind='stable')
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+    digest.update(notes[order].tobytes())
+    if amplitudes is not None:
+        digest.update(b'amplitudes')
+        digest.update(np.asarray(amplitudes, dtype=np.float32)[order].tobytes())
+    return digest.digest()
+
+
+class SegmentCache:
+    """Byte-bounded LRU of rendered segments shared by every request in the process
+
+    Colors snap to a small set of notes, so the same chord with the same brush, instrument
+    and duration recurs across users. Segments are stored read-only as float32 and copied
+    into each output buffer. ``render_fn(rng)`` gets a Generator seeded from the key, so
+    noisy brushes render the same samples for a key and can be cached as well.
+    """
+
+    def __init__(self, max_bytes: int = SEGMENT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._segments: 'OrderedDict[bytes, np.ndarray]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, notes, amplitudes, render_fn: Callable[[np.random.Generator], np.ndarray],
+                      **params) -> np.ndarray:
+        key = segment_key(notes, amplitudes, **params)
+        with self._lock:
+            segment = self._segments.get(key)
+            if segment is not None:
+                self._segments.move_to_end(key)
+                self.hits += 1
+                return segment
+            self.misses += 1
+        # Render outside the lock; two threads missing the same key just both render it
+        segment = np.asarray(render_fn(np.random.default_rng(int.from_bytes(key[:8], 'little'))), dtype=np.float32)
+        segment.flags.writeable = False
+        if segment.nbytes > self.max_bytes:
+            return segment
+        with self._lock:
+            if key not in self._segments:
+                self._segments[key] = segment
+                self.total_bytes += segment.nbytes
+                while self.total_bytes > self.max_bytes:
+                    _, evicted = self._segments.popitem(last=False)
+                    self.total_bytes -= evicted.nbytes
+                    self.evictions += 1
+        return segment
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._segments),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+
+# Rendered steps shared across requests: colors snap to 88 keys, so chords recur constantly
+segment_cache = SegmentCache()
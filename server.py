@@ -6,10 +6,8 @@ from io import BytesIO
 import numpy as np
 from scipy.io.wavfile import write as write_wav
 from scipy import signal
-from scipy.spatial import cKDTree
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 from flask import Flask, request, render_template, jsonify, send_from_directory, session, redirect, url_for
-from colorsys import rgb_to_hsv
 from dotenv import load_dotenv
 import msal
 import requests
@@ -23,8 +21,17 @@ import json
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from functools import lru_cache
+from functools import partial
 import concurrent.futures
+from color_tables import attach_tables, map_unique_colors
+from color_mappings import COLOR_MAPPINGS, DEFAULT_MAPPING, get_mapping, hue_octave_frequencies, register_mapping
+from canvas_state import CanvasState, CanvasStore
+from result_cache import ResultCache, result_key, seed_for
+from segment_cache import segment_cache
+from submissions import read_submission
+from synthesis import cached_step_renderer, chord_phase, normalize_to_int16, render_chord, render_sustained, render_timeline
+from wavetable import WavetableBank
+from timeline import Timeline, build_column_timeline, crop_to_painted, parse_flag, resolve_columns_per_step
 from midiutil import MIDIFile
 from asgiref.wsgi import WsgiToAsgi # ADDED
 
@@ -98,15 +105,18 @@ OUTPUT_DIR = "static/audio"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 SAMPLE_RATE = 44100
 DURATION_PER_STEP = 60 / 1000
+# Notes outside this range are clipped before synthesis
+TONE_RANGE = (20, 4200)
+# Instrument wavetables are built once at startup and shared by every render
+oscillators = WavetableBank(SAMPLE_RATE)
 
 NOTE_TO_SEMITONE = {'C': 0, 'C#': 1, 'D': 2, 'D#': 3, 'E': 4, 'F': 5, 'F#': 6, 'G': 7, 'G#': 8, 'A': 9, 'A#': 10, 'B': 11}
 note_names = list(NOTE_TO_SEMITONE.keys())
 
-# ... (Insert Frequency Map here - truncated for brevity but assuming it's needed for logic) ...
-# I will use a simplified map or the full one if I can copy paste, but I can't copy paste easily. 
 # --- FREQUENCY MAPPING (88-Keys) ---
 # Range: A0 (27.5 Hz) to C8 (4186 Hz)
-# We will use a predefined mapping for specific colors and interpolation for others.
+# The default freq_symbols map is shared with app.py through color_mappings; these anchors
+# only drive the server's hue_octave mapping.
 
 NOTE_FREQUENCIES = {
     'A0': 27.50, 'A#0': 29.14, 'B0': 30.87,
@@ -131,232 +141,122 @@ COLOR_FREQ_MAP = {
     # Add more as needed for interpolation anchors
 }
 
-# Build KD-Tree for interpolation
-def setup_color_tree():
-    global color_tree, color_list, freq_list
-    colors = np.array(list(COLOR_FREQ_MAP.keys()))
-    freqs = np.array(list(COLOR_FREQ_MAP.values()))
-    color_tree = cKDTree(colors)
-    color_list = colors
-    freq_list = freqs
-
-@lru_cache(maxsize=2000)
-def get_frequency_optimized(r, g, b):
-    # Ensure tree is built
-    if color_tree is None:
-        setup_color_tree()
-        
-    # Check exact match first
-    if (r, g, b) in COLOR_FREQ_MAP:
-        return COLOR_FREQ_MAP[(r, g, b)]
-        
-    # Interpolate using KD-Tree (find nearest neighbor)
-    # For better musicality, we map HSV Hue to Note (0-11) and Brightness to Octave
-    
-    # 1. Convert to HSV
-    h, s, v = rgb_to_hsv(r/255.0, g/255.0, b/255.0)
-    
-    # 2. Map Hue (0-1) to Note Index (0-11)
-    # A4 is 440.
-    # Hue 0 (Red) -> A4 (defined)
-    # Hue 0.33 (Green) -> C#5
-    # Hue 0.66 (Blue) -> E5
-    
-    # Let's map full spectrum to one octave then shift by brightness
-    # Base octave: 4 (C4 to B4)
-    base_note_index = int(h * 12) # 0-11
-    
-    # 3. Map Brightness (Value) to Octave (0-8)
-    # Darker = Lower, Brighter = Higher
-    # V=0 -> Octave 2, V=1 -> Octave 6
-    octave = int(2 + v * 4) 
-    
-    # Calculate frequency
-    # Note in scale: C, C#, D, D#, E, F, F#, G, G#, A, A#, B
-    # Freq = 440 * 2^((n-69)/12)
-    # C4 is MIDI 60. A4 is 69.
-    
-    # Relative to C (0)
-    # MIDI note = 12 * (octave + 1) + base_note_index
-    midi_note = 12 * (octave + 1) + base_note_index
-    
-    # Clamp to valid range (A0=21 to C8=108)
-    midi_note = max(21, min(108, midi_note))
-    
-    freq = 440.0 * (2 ** ((midi_note - 69) / 12.0))
-    
-    return freq
-
-# Replace old processing functions
-# Remove old maps to avoid conflict
-# I will try to include the critical parts.
-# Actually, I'll just use the provided code logic but I need the map.
-# Since I am replacing the file, I MUST include the map.
-# I will copy the map from the `view_file` output.
-
-freq_symbols = {
-    "A0": {"frequency": 27.50, "color": [139, 0, 0], "range": [27.50, 29.14], "symbol": "♩"},
-    # ... (I need the full map for the logic to work properly) ...
-    # This is risky. If I miss keys, it might break.
-    # But I can't paste 300 lines of map here easily without hitting token limits?
-    # No, I have 128k context, but output is limited.
-    # I will paste the full map.
-}
-# FILLING MAP
-freq_symbols = {
-    "A0": {"frequency": 27.50, "color": [139, 0, 0], "range": [27.50, 29.14], "symbol": "♩"},
-    "A#0/Bb0": {"frequency": 29.14, "color": [255, 69, 0], "range": [29.14, 30.87], "symbol": "♯"},
-    "B0": {"frequency": 30.87, "color": [204, 204, 0], "range": [30.87, 32.70], "symbol": "♩"},
-    "C1": {"frequency": 32.70, "color": [102, 152, 0], "range": [32.70, 34.65], "symbol": "♩"},
-    "C#1/Db1": {"frequency": 34.65, "color": [0, 100, 0], "range": [34.65, 36.71], "symbol": "♯"},
-    "D1": {"frequency": 36.71, "color": [0, 50, 69], "range": [36.71, 38.89], "symbol": "♩"},
-    "D#1/Eb1": {"frequency": 38.89, "color": [0, 0, 139], "range": [38.89, 41.20], "symbol": "♯"},
-    "E1": {"frequency": 41.20, "color": [75, 0, 130], "range": [41.20, 43.65], "symbol": "♩"},
-    "F1": {"frequency": 43.65, "color": [112, 0, 171], "range": [43.65, 46.25], "symbol": "♩"},
-    "F#1/Gb1": {"frequency": 46.25, "color": [148, 0, 211], "range": [46.25, 49.00], "symbol": "♯"},
-    "G1": {"frequency": 49.00, "color": [157, 0, 106], "range": [49.00, 51.91], "symbol": "♩"},
-    "G#1/Ab1": {"frequency": 51.91, "color": [165, 0, 0], "range": [51.91, 55.00], "symbol": "♯"},
-    "A1": {"frequency": 55.00, "color": [210, 0, 128], "range": [55.00, 58.27], "symbol": "♩"},
-    "A#1/Bb1": {"frequency": 58.27, "color": [255, 94, 0], "range": [58.27, 61.74], "symbol": "♯"},
-    "B1": {"frequency": 61.74, "color": [221, 221, 0], "range": [61.74, 65.41], "symbol": "♩"},
-    "C2": {"frequency": 65.41, "color": [111, 175, 0], "range": [65.41, 69.30], "symbol": "♩"},
-    "C#2/Db2": {"frequency": 69.30, "color": [0, 128, 0], "range": [69.30, 73.42], "symbol": "♯"},
-    "D2": {"frequency": 73.42, "color": [0, 64, 85], "range": [73.42, 77.78], "symbol": "♩"},
-    "D#2/Eb2": {"frequency": 77.78, "color": [0, 0, 170], "range": [77.78, 82.41], "symbol": "♯"},
-    "E2": {"frequency": 82.41, "color": [92, 0, 159], "range": [82.41, 87.31], "symbol": "♩"},
-    "F2": {"frequency": 87.31, "color": [119, 0, 96], "range": [87.31, 92.50], "symbol": "♩"},
-    "F#2/Gb2": {"frequency": 92.50, "color": [159, 0, 226], "range": [92.50, 98.00], "symbol": "♯"},
-    "G2": {"frequency": 98.00, "color": [175, 0, 113], "range": [98.00, 103.83], "symbol": "♩"},
-    "G#2/Ab2": {"frequency": 103.83, "color": [191, 0, 0], "range": [103.83, 110.00], "symbol": "♯"},
-    "A2": {"frequency": 110.00, "color": [223, 59, 128], "range": [110.00, 116.54], "symbol": "♩"},
-    "A#2/Bb2": {"frequency": 116.54, "color": [255, 119, 0], "range": [116.54, 123.47], "symbol": "♯"},
-    "B2": {"frequency": 123.47, "color": [238, 238, 0], "range": [123.47, 130.81], "symbol": "♩"},
-    "C3": {"frequency": 130.81, "color": [119, 159, 0], "range": [130.81, 138.59], "symbol": "♩"},
-    "C#3/Db3": {"frequency": 138.59, "color": [0, 160, 0], "range": [138.59, 146.83], "symbol": "♯"},
-    "D3": {"frequency": 146.83, "color": [0, 80, 100], "range": [146.83, 155.56], "symbol": "♩"},
-    "D#3/Eb3": {"frequency": 155.56, "color": [0, 0, 200], "range": [155.56, 164.81], "symbol": "♯"},
-    "E3": {"frequency": 164.81, "color": [109, 0, 188], "range": [164.81, 174.61], "symbol": "♩"},
-    "F3": {"frequency": 174.61, "color": [140, 0, 215], "range": [174.61, 185.00], "symbol": "♩"},
-    "F#3/Gb3": {"frequency": 185.00, "color": [170, 0, 241], "range": [185.00, 196.00], "symbol": "♯"},
-    "G3": {"frequency": 196.00, "color": [194, 0, 121], "range": [196.00, 207.65], "symbol": "♩"},
-    "G#3/Ab3": {"frequency": 207.65, "color": [217, 0, 0], "range": [207.65, 220.00], "symbol": "♯"},
-    "A3": {"frequency": 220.00, "color": [236, 72, 0], "range": [220.00, 233.08], "symbol": "♩"},
-    "A#3/Bb3": {"frequency": 233.08, "color": [255, 144, 0], "range": [233.08, 246.94], "symbol": "♯"},
-    "B3": {"frequency": 246.94, "color": [255, 255, 0], "range": [246.94, 261.63], "symbol": "♩"},
-    "C4": {"frequency": 261.63, "color": [128, 224, 0], "range": [261.63, 277.18], "symbol": "♩"},
-    "C#4/Db4": {"frequency": 277.18, "color": [0, 192, 0], "range": [277.18, 293.66], "symbol": "♯"},
-    "D4": {"frequency": 293.66, "color": [0, 96, 115], "range": [293.66, 311.13], "symbol": "♩"},
-    "D#4/Eb4": {"frequency": 311.13, "color": [0, 0, 230], "range": [311.13, 329.63], "symbol": "♯"},
-    "E4": {"frequency": 329.63, "color": [126, 0, 217], "range": [329.63, 349.23], "symbol": "♩"},
-    "F4": {"frequency": 349.23, "color": [159, 26, 236], "range": [349.23, 369.99], "symbol": "♩"},
-    "F#4/Gb4": {"frequency": 369.99, "color": [191, 51, 255], "range": [369.99, 392.00], "symbol": "♯"},
-    "G4": {"frequency": 392.00, "color": [217, 26, 128], "range": [392.00, 415.30], "symbol": "♩"},
-    "G#4/Ab4": {"frequency": 415.30, "color": [243, 0, 0], "range": [415.30, 440.00], "symbol": "♯"},
-    "A4": {"frequency": 440.00, "color": [249, 85, 0], "range": [440.00, 466.16], "symbol": "♩"},
-    "A#4/Bb4": {"frequency": 466.16, "color": [255, 169, 0], "range": [466.16, 493.88], "symbol": "♯"},
-    "B4": {"frequency": 493.88, "color": [255, 255, 51], "range": [493.88, 523.25], "symbol": "♩"},
-    "C5": {"frequency": 523.25, "color": [153, 255, 51], "range": [523.25, 554.37], "symbol": "♩"},
-    "C#5/Db5": {"frequency": 554.37, "color": [51, 255, 51], "range": [554.37, 587.33], "symbol": "♯"},
-    "D5": {"frequency": 587.33, "color": [51, 204, 204], "range": [587.33, 622.25], "symbol": "♪"},
-    "D#5/Eb5": {"frequency": 622.25, "color": [51, 51, 255], "range": [622.25, 659.25], "symbol": "♭"},
-    "E5": {"frequency": 659.25, "color": [128, 51, 255], "range": [659.25, 698.46], "symbol": "𝅘𝅥𝅮"},
-    "F5": {"frequency": 698.46, "color": [159, 87, 255], "range": [698.46, 739.99], "symbol": "♩"},
-    "F#5/Gb5": {"frequency": 739.99, "color": [190, 123, 255], "range": [739.99, 783.99], "symbol": "♯"},
-    "G5": {"frequency": 783.99, "color": [204, 87, 128], "range": [783.99, 830.61], "symbol": "♫"},
-    "G#5/Ab5": {"frequency": 830.61, "color": [255, 51, 51], "range": [830.61, 880.00], "symbol": "♭"},
-    "A5": {"frequency": 880.00, "color": [255, 128, 102], "range": [880.00, 932.33], "symbol": "𝅗𝅥"},
-    "A#5/Bb5": {"frequency": 932.33, "color": [255, 204, 102], "range": [932.33, 987.77], "symbol": "♯"},
-    "B5": {"frequency": 987.77, "color": [255, 255, 102], "range": [987.77, 1046.50], "symbol": "𝅘𝅥"},
-    "C6": {"frequency": 1046.50, "color": [179, 255, 102], "range": [1046.50, 1108.73], "symbol": "♩"},
-    "C#6/Db6": {"frequency": 1108.73, "color": [102, 255, 102], "range": [1108.73, 1174.66], "symbol": "♯"},
-    "D6": {"frequency": 1174.66, "color": [102, 204, 204], "range": [1174.66, 1244.51], "symbol": "♪"},
-    "D#6/Eb6": {"frequency": 1244.51, "color": [102, 102, 255], "range": [1244.51, 1318.51], "symbol": "♭"},
-    "E6": {"frequency": 1318.51, "color": [153, 102, 255], "range": [1318.51, 1396.91], "symbol": "𝅘𝅥𝅮"},
-    "F6": {"frequency": 1396.91, "color": [171, 128, 255], "range": [1396.91, 1479.98], "symbol": "♩"},
-    "F#6/Gb6": {"frequency": 1479.98, "color": [201, 153, 255], "range": [1479.98, 1567.98], "symbol": "♯"},
-    "G6": {"frequency": 1567.98, "color": [209, 128, 153], "range": [1567.98, 1661.22], "symbol": "♫"},
-    "G#6/Ab6": {"frequency": 1661.22, "color": [255, 102, 102], "range": [1661.22, 1760.00], "symbol": "♭"},
-    "A6": {"frequency": 1760.00, "color": [255, 153, 128], "range": [1760.00, 1864.66], "symbol": "𝅗𝅥"},
-    "A#6/Bb6": {"frequency": 1864.66, "color": [255, 204, 153], "range": [1864.66, 1975.53], "symbol": "♯"},
-    "B6": {"frequency": 1975.53, "color": [255, 255, 153], "range": [1975.53, 2093.00], "symbol": "𝅘𝅥"},
-    "C7": {"frequency": 2093.00, "color": [204, 255, 153], "range": [2093.00, 2217.46], "symbol": "♩"},
-    "C#7/Db7": {"frequency": 2217.46, "color": [153, 255, 153], "range": [2217.46, 2349.32], "symbol": "♯"},
-    "D7": {"frequency": 2349.32, "color": [153, 204, 204], "range": [2349.32, 2489.02], "symbol": "♪"},
-    "D#7/Eb7": {"frequency": 2489.02, "color": [153, 153, 255], "range": [2489.02, 2637.02], "symbol": "♭"},
-    "E7": {"frequency": 2637.02, "color": [197, 153, 255], "range": [2637.02, 2793.83], "symbol": "𝅘𝅥𝅮"},
-    "F7": {"frequency": 2793.83, "color": [222, 176, 255], "range": [2793.83, 2959.96], "symbol": "♩"},
-    "F#7/Gb7": {"frequency": 2959.96, "color": [246, 198, 255], "range": [2959.96, 3135.96], "symbol": "♯"},
-    "G7": {"frequency": 3135.96, "color": [255, 176, 204], "range": [3135.96, 3322.44], "symbol": "♫"},
-    "G#7/Ab7": {"frequency": 3322.44, "color": [255, 153, 153], "range": [3322.44, 3520.00], "symbol": "♭"},
-    "A7": {"frequency": 3520.00, "color": [255, 194, 176], "range": [3520.00, 3729.31], "symbol": "𝅗𝅥"},
-    "A#7/Bb7": {"frequency": 3729.31, "color": [255, 234, 198], "range": [3729.31, 3951.07], "symbol": "♯"},
-    "B7": {"frequency": 3951.07, "color": [255, 255, 204], "range": [3951.07, 4186.01], "symbol": "𝅘𝅥"},
-    "C8": {"frequency": 4186.01, "color": [144, 238, 144], "range": [4186.01, 4434.92], "symbol": "♩"},
-}
-
-color_tree = None
-color_list = None
-freq_list = None
-
-def setup_color_tree():
-    global color_tree, color_list, freq_list
-    if color_tree is None:
-        colors = []
-        frequencies = []
-        for note, props in freq_symbols.items():
-            colors.append(props["color"])
-            frequencies.append(props["frequency"])
-        color_list = np.array(colors)
-        freq_list = np.array(frequencies)
-        color_tree = cKDTree(color_list)
-
-@lru_cache(maxsize=1000)
 def get_frequency_optimized(r, g, b):
-    setup_color_tree()
-    target = [r, g, b]
-    for note, props in freq_symbols.items():
-        if props["color"] == target:
-            return props["frequency"]
-    distance, index = color_tree.query(target)
-    if distance < 15:
-        return freq_list[index]
-    return interpolate_frequency(target, index)
-
-def interpolate_frequency(color, nearest_index):
-    nearest_color = color_list[nearest_index]
-    base_freq = freq_list[nearest_index]
-    hsv1 = rgb_to_hsv(*(c/255 for c in color))
-    hsv2 = rgb_to_hsv(*(c/255 for c in nearest_color))
-    hue_diff = abs(hsv1[0] - hsv2[0])
-    hue_diff = min(hue_diff, 1 - hue_diff)
-    freq_multiplier = 1 + (hue_diff - 0.5) * 0.1
-    return base_freq * freq_multiplier
-
-def process_image_optimized(img):
+    return float(get_mapping(DEFAULT_MAPPING).map(np.array([[r, g, b]]))[0])
+
+def process_image_optimized(img, mapping=None, columns_per_step=1, weighted=False):
+    # weighted: per-note amplitudes from painted coverage (of height x columns_per_step) instead of a flat chord
+    # Empty or all-black canvases stop here; x_offset keeps columns at their canvas position
+    canvas_height = img.height
+    img, x_offset = crop_to_painted(img)
+    if img is None:
+        return Timeline.empty()
     width, height = img.size
     img_array = np.array(img)
     pixels = img_array.reshape(-1, 4)
     valid_mask = (pixels[:, 3] > 200) & ~((pixels[:, :3] == 0).all(axis=1))
     valid_pixels = pixels[valid_mask]
     if len(valid_pixels) == 0:
-        return {}
-    timeline = {}
-    x_coords = np.arange(len(pixels)) % width
-    for i, pixel in enumerate(valid_pixels):
-        if valid_mask[i]:
-            x_coord = x_coords[i]
-            r, g, b, a = pixel
-            freq = get_frequency_optimized(r, g, b)
-            if freq and freq > 0:
-                if x_coord not in timeline:
-                    timeline[x_coord] = []
-                timeline[x_coord].append(freq)
-    for x in timeline:
-        timeline[x] = sorted(list(set(timeline[x])))
-    return timeline
-
-def generate_drone(frequencies, duration=10):
-    """Generate a sustained drone texture from a list of frequencies"""
+        return Timeline.empty()
+    x_coords = np.flatnonzero(valid_mask) % width + x_offset
+    color_mapping = get_mapping(mapping)
+    frequencies, unique_colors = map_unique_colors(valid_pixels[:, :3], color_mapping.map)
+    logger.info(f"Mapped {len(valid_pixels)} pixels through {unique_colors} unique colors ({color_mapping.name})")
+    return build_column_timeline(
+        x_coords, frequencies, columns_per_step, weighted, step_capacity=canvas_height * columns_per_step
+    )
+
+# Map the default color table at boot so every worker starts warm; other mappings build
+# their tables on first use (the host build lock keeps that to one builder per table)
+attach_tables(get_mapping(DEFAULT_MAPPING).table)
+register_mapping(
+    'hue_octave', lambda rgb: hue_octave_frequencies(rgb, anchors=COLOR_FREQ_MAP),
+    description="Hue selects the note, brightness the octave (2-6); COLOR_FREQ_MAP colors are exact"
+)
+
+MAX_UPLOAD_SIZE = 800
+# Uploads above this many source pixels are rejected from the header, before any decoding
+MAX_UPLOAD_PIXELS = int(os.getenv('MAX_UPLOAD_PIXELS', 64_000_000))
+# Modes Image.reduce can work on without a conversion pass first
+REDUCIBLE_MODES = {'L', 'LA', 'RGB', 'RGBA', 'RGBa', 'I', 'F'}
+
+class UploadTooLarge(ValueError):
+    """The upload's header declares more source pixels than MAX_UPLOAD_PIXELS"""
+
+def decode_upload(file, max_size=MAX_UPLOAD_SIZE, max_pixels=MAX_UPLOAD_PIXELS):
+    """Decode an upload directly at reduced resolution, at most max_size px on each side, as RGBA.
+    Raises UploadTooLarge if the source image is over the pixel budget."""
+    img = Image.open(file)  # Reads the header only
+    width, height = img.size
+    if width * height > max_pixels:
+        raise UploadTooLarge(f"Image too large: {width}x{height} exceeds {max_pixels} pixels")
+    if img.format == 'JPEG':
+        # Let the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding
+        img.draft('RGB', (max_size, max_size))
+    factor = max(img.size) // max_size
+    if factor >= 2:
+        # Box-reduce in the source mode so the full-size image is never expanded to RGBA
+        if img.mode not in REDUCIBLE_MODES:
+            img = img.convert('RGBA')
+        img = img.reduce(factor)
+    img.thumbnail((max_size, max_size))
+    return img.convert('RGBA')
+
+MAX_PALETTE_SIZE = 256
+
+def quantize_image(img, palette_size):
+    """Reduce an RGBA image to at most palette_size representative colors.
+    Returns (palette RGB array, per-pixel palette index array, alpha array)."""
+    palette_size = max(2, min(MAX_PALETTE_SIZE, int(palette_size)))
+    quantized = img.convert('RGB').quantize(colors=palette_size, method=Image.Quantize.MEDIANCUT)
+    indices = np.array(quantized)
+    palette = np.array(quantized.getpalette()[:3 * palette_size], dtype=np.uint8).reshape(-1, 3)
+    alpha = np.array(img.getchannel('A'))
+    return palette, indices, alpha
+
+def process_image_palette(img, palette_size, mapping=None, columns_per_step=1, weighted=False):
+    """Quantize the image, map only the palette entries and build a palette-indexed timeline.
+    With ``weighted``, entries carry their coverage of the step (of height x columns_per_step)
+    as amplitude. Returns (Timeline of uint8 palette indices, palette frequency array)."""
+    canvas_height = img.height
+    img, x_offset = crop_to_painted(img)
+    if img is None:
+        return Timeline.empty(np.uint8), np.zeros(0)
+    palette, indices, alpha = quantize_image(img, palette_size)
+    palette_freqs = get_mapping(mapping).map(palette)
+    # Same validity rule as process_image_optimized: opaque and not pure black
+    usable = (palette_freqs > 0) & (palette != 0).any(axis=1)
+    valid = (alpha > 200) & usable[indices]
+    ys, xs = np.nonzero(valid)
+    if len(xs) == 0:
+        return Timeline.empty(np.uint8), palette_freqs
+    # One np.unique over (step, palette index) keys dedups every step at once
+    steps = (xs.astype(np.int64) + x_offset) // columns_per_step
+    keys = steps * len(palette) + indices[ys, xs]
+    if not weighted:
+        columns, entries = np.divmod(np.unique(keys), len(palette))
+        return Timeline.from_entries(columns, entries, note_dtype=np.uint8), palette_freqs
+    keys, counts = np.unique(keys, return_counts=True)
+    columns, entries = np.divmod(keys, len(palette))
+    coverage = counts / float(canvas_height * columns_per_step)
+    return Timeline.from_entries(columns, entries, coverage, note_dtype=np.uint8), palette_freqs
+
+def palette_timeline_to_frequencies(palette_timeline, palette_freqs):
+    """Expand a palette-indexed timeline into the frequency Timeline used for synthesis"""
+    # Distinct palette entries can share a frequency, so regroup to keep columns unique
+    weights = palette_timeline.amplitudes
+    return build_column_timeline(
+        palette_timeline.column_index(), palette_freqs[palette_timeline.notes],
+        weighted=weights is not None, weights=weights, step_capacity=1
+    )
+
+def generate_drone(frequencies, duration=10, rng=None):
+    """Generate a sustained drone texture from a list of frequencies
+
+    ``rng`` (a numpy Generator) drives the random modulation; pass a seeded one for
+    reproducible output.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
     if not frequencies:
         return np.zeros(int(SAMPLE_RATE * duration))
         
@@ -376,7 +276,7 @@ def generate_drone(frequencies, duration=10):
 
     for freq in selected_freqs:
         # Slow modulation for organic feel
-        mod = 1 + 0.005 * np.sin(2 * np.pi * 0.2 * t + np.random.random() * 2 * np.pi)
+        mod = 1 + 0.005 * np.sin(2 * np.pi * 0.2 * t + rng.random() * 2 * np.pi)
         phase = 2 * np.pi * freq * t
         
         # Sine + Soft Saw mixture
@@ -384,7 +284,7 @@ def generate_drone(frequencies, duration=10):
         
         # Stereo-like widening (if we were stereo, but we are mono here)
         # Random amplitude envelope for "swelling"
-        amp_mod = 0.5 + 0.5 * np.sin(2 * np.pi * (0.1 + np.random.random()*0.2) * t)
+        amp_mod = 0.5 + 0.5 * np.sin(2 * np.pi * (0.1 + rng.random()*0.2) * t)
         
         waveform += tone * amp_mod
 
@@ -441,14 +341,12 @@ def frequencies_to_midi(frequencies, filename):
             pitch = max(0, min(127, pitch))
             midi.addNote(track, channel, pitch, time, 8, volume) # 8 beats duration
             
-    elif isinstance(frequencies, dict): # Timeline mode
-        # Keys are time steps (x coord)
-        sorted_keys = sorted(frequencies.keys())
+    elif isinstance(frequencies, Timeline): # Timeline mode
+        # One step per sounding column
         step_duration = 0.25 # quarter beat
         
-        for x in sorted_keys:
-            freqs = frequencies[x]
-            for freq in freqs:
+        for x, freqs in frequencies.items():
+            for freq in freqs.tolist():
                 if freq <= 0: continue
                 pitch = int(round(69 + 12 * np.log2(freq / 440.0)))
                 pitch = max(0, min(127, pitch))
@@ -459,87 +357,56 @@ def frequencies_to_midi(frequencies, filename):
         midi.writeFile(output_file)
     return filename
 
-def generate_tone(frequencies, brush, instrument="sine", duration=DURATION_PER_STEP):
-    # 1. Base Waveform Selection (Instrument)
+def chord_tones(freqs, t, brush, instrument="sine", rng=None):
+    """Brush-shaped instrument tones for a block of chord notes, one row per frequency"""
+    # 1. Base Waveform Selection (Instrument), read from the band-limited wavetables
+    def get_base_wave(freqs, t, inst_type):
+        return oscillators.render(inst_type, freqs, t)
+
+    base_sig = get_base_wave(freqs, t, instrument)
+    
+    # 2. Brush Modulation & Effects
+    if brush == "round":
+        # Pure, slight smooth attack
+        return base_sig
+    elif brush == "square":
+        # Hard clip / bitcrush effect
+        return np.clip(base_sig * 2, -0.8, 0.8)
+    elif brush == "sawtooth":
+        # Add buzz/noise
+        return base_sig + 0.1 * ((rng or np.random).random(base_sig.shape) - 0.5)
+    elif brush == "star":
+        # Additive harmonic (Octave up)
+        return base_sig + 0.5 * get_base_wave(freqs * 2, t, instrument)
+    elif brush == "cross":
+        # Beating (Detuned)
+        detuned = get_base_wave(freqs + 2, t, instrument)
+        return 0.6 * base_sig + 0.4 * detuned
+    elif brush == "spray":
+        # FM Wobble (LFO 5Hz)
+        lfo = 5 * np.sin(2 * np.pi * 5 * t)
+        if instrument == "sine":
+            # Re-generate base with modulated freq
+            return np.sin(chord_phase(freqs[:, None] + lfo * 10, t))
+        # Amplitude Modulation instead for spray effect on complex waves
+        return base_sig * (0.5 + 0.5 * np.sin(2 * np.pi * 15 * t))
+    return base_sig
+
+def generate_tone(frequencies, brush, instrument="sine", duration=DURATION_PER_STEP, rng=None, amplitudes=None):
+    # rng: optional numpy Generator for brush noise, so cached renders are reproducible
+    # amplitudes: optional per-frequency gains from a weighted timeline (default all 1);
+    # weighted steps keep their coverage level, so only flat chords are peak-normalized
     t = np.linspace(0, duration, int(SAMPLE_RATE * duration), False)
-    if frequencies == 0 or not isinstance(frequencies, (list, np.ndarray)) or len(frequencies) == 0:
+    if not isinstance(frequencies, (list, np.ndarray)) or len(frequencies) == 0:
         return np.zeros_like(t)
     
     # Filter frequencies below 20Hz (Sub-bass / DC offset) or extremely high
-    frequencies = np.clip(frequencies, 20, 4200)
-    waveform = np.zeros_like(t)
-
-    # Helper: Base Oscillator
-    def get_base_wave(freq, t, inst_type):
-        # Ignore frequencies that are essentially silence/noise
-        if freq < 20: return np.zeros_like(t)
-        
-        phase = 2 * np.pi * freq * t
-        if inst_type == "sine":
-            return np.sin(phase)
-        elif inst_type == "square" or inst_type == "retro":
-            return signal.square(phase)
-        elif inst_type == "sawtooth" or inst_type == "soft_saw":
-            return signal.sawtooth(phase)
-        elif inst_type == "triangle":
-            return signal.sawtooth(phase, width=0.5)
-        elif inst_type == "piano":
-            # Approximation of piano harmonics
-            return (1.0 * np.sin(phase) + 
-                    0.5 * np.sin(2*phase) * np.exp(-t) + 
-                    0.3 * np.sin(3*phase) * np.exp(-2*t))
-        elif inst_type == "rhodes":
-            # Electric piano: sine + light modulation
-            return np.sin(phase) + 0.2 * np.sin(14 * phase) * np.exp(-t*2)
-        elif inst_type == "strings":
-            # Sawtooth + rich chorus-like detuning
-            return 0.5 * signal.sawtooth(phase) + 0.5 * signal.sawtooth(2 * np.pi * (freq * 1.01) * t)
-        elif inst_type == "bell":
-            # FM Synthesis: Modulator 2.0 ratio
-            return np.sin(phase + 2.0 * np.sin(2.0 * phase) * np.exp(-t*3))
-        else:
-            return np.sin(phase)
-
-    # 2. Brush Modulation & Effects
-    for freq in frequencies:
-        base_sig = get_base_wave(freq, t, instrument)
-        
-        # Apply Brush Characteristics
-        if brush == "round":
-            # Pure, slight smooth attack
-            tone = base_sig
-        elif brush == "square":
-            # Hard clip / bitcrush effect
-            tone = np.clip(base_sig * 2, -0.8, 0.8)
-        elif brush == "sawtooth":
-            # Add buzz/noise
-            tone = base_sig + 0.1 * (np.random.rand(len(t)) - 0.5)
-        elif brush == "star":
-            # Additive harmonic (Octave up)
-            tone = base_sig + 0.5 * get_base_wave(freq * 2, t, instrument)
-        elif brush == "cross":
-            # Beating (Detuned)
-            detuned = get_base_wave(freq + 2, t, instrument)
-            tone = 0.6 * base_sig + 0.4 * detuned
-        elif brush == "spray":
-            # FM Wobble (LFO 5Hz)
-            lfo = 5 * np.sin(2 * np.pi * 5 * t)
-            # Re-generate base with modulated freq
-            phase_mod = 2 * np.pi * (freq + lfo * 10) * t
-            if instrument == "sine":
-                tone = np.sin(phase_mod)
-            else:
-                tone = base_sig # Fallback for complex waves to avoid recalculating
-                # Amplitude Modulation instead for spray effect
-                tone = tone * (0.5 + 0.5 * np.sin(2 * np.pi * 15 * t))
-        else:
-            tone = base_sig
-
-        waveform += tone
+    frequencies = np.clip(frequencies, *TONE_RANGE)
+    waveform = render_chord(frequencies, lambda freqs: chord_tones(freqs, t, brush, instrument, rng), amplitudes)
 
     # Normalize
     max_val = np.max(np.abs(waveform))
-    if max_val > 0:
+    if max_val > 0 and amplitudes is None:
         waveform /= max_val
 
     # Envelope
@@ -573,6 +440,35 @@ def generate_tone(frequencies, brush, instrument="sine", duration=DURATION_PER_S
     if max_val > 0: waveform /= max_val
     return waveform
 
+def step_renderer(brush, instrument="sine", duration=DURATION_PER_STEP):
+    """generate_tone for one step at a time, answered from the shared segment cache"""
+    return cached_step_renderer(
+        segment_cache, partial(generate_tone, brush=brush, instrument=instrument, duration=duration),
+        brush=brush, instrument=instrument, duration=duration, sample_rate=SAMPLE_RATE
+    )
+
+canvas_states = CanvasStore()
+# Identical resubmissions are answered with the files already rendered for them
+result_cache = ResultCache(OUTPUT_DIR)
+
+def render_canvas(state, brush, instrument, rng=None, sustain=False):
+    """Render a canvas state to a new WAV, reusing segments of unchanged steps.
+    Call with state.lock held. Returns (filename, reused segment count).
+    Per-step segments come from the segment cache; ``rng`` only seeds sustained renders."""
+    if sustain:
+        # Held notes span steps, so there are no per-step segments to reuse
+        audio = render_sustained(
+            state.timeline(), lambda freqs, t: chord_tones(freqs, t, brush, instrument, rng),
+            int(SAMPLE_RATE * DURATION_PER_STEP), SAMPLE_RATE, freq_range=TONE_RANGE
+        )
+        reused = 0
+    else:
+        audio, reused = state.render((brush, instrument), step_renderer(brush, instrument))
+    audio_int16 = normalize_to_int16(audio)
+    filename = f"sound_{int(time.time() * 1000)}.wav"
+    write_wav(os.path.join(OUTPUT_DIR, filename), SAMPLE_RATE, audio_int16)
+    return filename, reused
+
 @app.route("/")
 def home():
     return render_template("index.html")
@@ -580,29 +476,85 @@ def home():
 @app.route("/submit", methods=['POST'])
 def submit():
     try:
-        data = request.json
-        if 'image' not in data:
+        data, image_bytes = read_submission()
+        if image_bytes is None:
             return jsonify({"error": "No image provided"}), 400
-        image_data = data['image'].split(',')[1]
-        img = Image.open(BytesIO(base64.b64decode(image_data))).convert('RGBA')
-        timeline = process_image_optimized(img)
-        stop = max((x for x, freqs in timeline.items() if freqs), default=0)
-        timeline = {x: timeline.get(x, 0) for x in range(stop + 1)}
-        audio_segments = []
+        try:
+            img = Image.open(BytesIO(image_bytes)).convert('RGBA')
+        except (UnidentifiedImageError, OSError) as e:
+            logger.error(f"Invalid image data: {e}")
+            return jsonify({"error": "Invalid image data"}), 400
+        mapping = data.get('mapping', DEFAULT_MAPPING)
+        if mapping not in COLOR_MAPPINGS:
+            return jsonify({"error": f"Invalid mapping: {mapping}. Valid options are {sorted(COLOR_MAPPINGS)}"}), 400
+        try:
+            columns_per_step = resolve_columns_per_step(
+                img.width, DURATION_PER_STEP, data.get('columns_per_step'), data.get('duration')
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid time resolution: {e}"}), 400
         brush = data.get('brush', 'round')
         instrument = data.get('instrument', 'sine')
-        for x in range(stop + 1):
-            segment = generate_tone(timeline.get(x, 0), brush, instrument)
-            audio_segments.append(segment)
-        if not audio_segments:
-            return jsonify({"error": "No audio generated"}), 400
-        audio = np.concatenate(audio_segments)
-        audio = audio / (np.max(np.abs(audio)) + 1e-6)
-        audio_int16 = np.int16(audio * 32767)
-        filename = f"sound_{int(time.time() * 1000)}.wav"
-        filepath = os.path.join(OUTPUT_DIR, filename)
-        write_wav(filepath, SAMPLE_RATE, audio_int16)
-        return jsonify({"url": f"/static/audio/{filename}"})
+        weighted = parse_flag(data.get('weighted', False))
+        sustain = parse_flag(data.get('sustain', False))
+        # Empty or all-black canvases are rejected before any hashing or canvas state
+        if crop_to_painted(img)[0] is None:
+            return jsonify({"error": "No valid colors detected"}), 400
+        pixels = np.asarray(img)
+        key = result_key(
+            pixels, route="submit", brush=brush, instrument=instrument, mapping=mapping,
+            columns_per_step=columns_per_step, weighted=weighted, sustain=sustain
+        )
+        cached = result_cache.get(key)
+        if cached is not None:
+            # No canvas state was built, so deltas must start from a full submit again
+            session.pop('canvas_id', None)
+            return jsonify(cached)
+        state = CanvasState(
+            pixels, lambda region, k: process_image_optimized(region, mapping, k, weighted), columns_per_step
+        )
+        # Painted colors can still all map to silence; such canvases are never stored
+        if not state.sounding_steps():
+            return jsonify({"error": "No valid colors detected"}), 400
+        # Keep the canvas for this session so later strokes can be sent as /submit_delta
+        session['canvas_id'] = canvas_states.put(state, session.get('canvas_id'))
+        with state.lock:
+            filename, _ = render_canvas(state, brush, instrument, np.random.default_rng(seed_for(key)), sustain)
+        result = {"url": f"/static/audio/{filename}"}
+        result_cache.put(key, [filename], result)
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/submit_delta", methods=['POST'])
+def submit_delta():
+    try:
+        data = request.json
+        state = canvas_states.get(session.get('canvas_id'))
+        size = (data.get("width"), data.get("height"))
+        if state is None or (None not in size and size != (state.width, state.height)):
+            return jsonify({"error": "No matching canvas for this session; submit the full canvas", "resync": True}), 409
+        try:
+            patches = [
+                (int(rect['x']), int(rect['y']),
+                 np.asarray(Image.open(BytesIO(base64.b64decode(rect['image'].split(',')[1]))).convert('RGBA')))
+                for rect in data.get('rects', [])
+            ]
+        except (KeyError, IndexError, TypeError, ValueError, OSError) as e:
+            return jsonify({"error": f"Invalid dirty rectangle: {e}"}), 400
+        brush = data.get('brush', 'round')
+        instrument = data.get('instrument', 'sine')
+        sustain = parse_flag(data.get('sustain', False))
+        with state.lock:
+            recomputed = sum(state.apply_patch(x, y, patch) for x, y, patch in patches)
+            if not state.sounding_steps():
+                return jsonify({"error": "No valid colors detected"}), 400
+            filename, reused = render_canvas(state, brush, instrument, sustain=sustain)
+        return jsonify({
+            "url": f"/static/audio/{filename}",
+            "stats": {"recomputed_steps": recomputed, "reused_segments": reused}
+        })
     except Exception as e:
         logger.error(f"Error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -611,6 +563,10 @@ def submit():
 def serve_audio(filename):
     return send_from_directory(OUTPUT_DIR, filename)
 
+@app.route("/api/cache-stats")
+def cache_stats():
+    return jsonify({"results": result_cache.stats(), "segments": segment_cache.stats()})
+
 @app.route("/api/sonify-upload", methods=['POST'])
 def sonify_upload():
     try:
@@ -619,17 +575,61 @@ def sonify_upload():
             
         file = request.files['image']
         mode = request.form.get('mode', 'timeline') # 'timeline' or 'colorfield'
+        # Optional: quantize to N representative colors before sonification
+        palette_size = request.form.get('palette_size', type=int)
+        mapping = request.form.get('mapping', DEFAULT_MAPPING)
+        # Optional: chord notes get amplitudes from how much of the column they cover
+        weighted = parse_flag(request.form.get('weighted', False))
+        # Optional: hold repeated colors as one continuous note instead of one per step
+        sustain = parse_flag(request.form.get('sustain', False))
+        if mapping not in COLOR_MAPPINGS:
+            return jsonify({"error": f"Invalid mapping: {mapping}. Valid options are {sorted(COLOR_MAPPINGS)}"}), 400
         
         if file.filename == '':
             return jsonify({"error": "No selected file"}), 400
             
-        img = Image.open(file).convert('RGBA')
+        # Decode at reduced resolution for performance (max 800px)
+        try:
+            img = decode_upload(file)
+        except (UploadTooLarge, Image.DecompressionBombError) as e:
+            return jsonify({"error": str(e)}), 413
+        except (UnidentifiedImageError, OSError, ValueError) as e:
+            logger.error(f"Invalid image data: {e}")
+            return jsonify({"error": "Invalid image data"}), 400
+        
+        # Faster playback for uploaded images? Or standard?
+        # Let's use a slightly faster duration per step for higher resolution feeling
+        step_dur = 0.05
+        try:
+            columns_per_step = resolve_columns_per_step(
+                img.width, step_dur, request.form.get('columns_per_step'), request.form.get('duration')
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid time resolution: {e}"}), 400
         
-        # Resize for performance (max 800px)
-        img.thumbnail((800, 800))
+        key = result_key(
+            np.asarray(img), route="sonify-upload", mode=mode, palette_size=palette_size,
+            mapping=mapping, columns_per_step=columns_per_step, weighted=weighted, sustain=sustain
+        )
+        cached = result_cache.get(key)
+        if cached is not None:
+            cached["stats"] = dict(cached["stats"], cached=True)
+            return jsonify(cached)
+        rng = np.random.default_rng(seed_for(key))
         
         # Process image
-        timeline = process_image_optimized(img)
+        start_time = time.time()
+        stats = {"columns_per_step": columns_per_step, "weighted": weighted, "sustain": sustain}
+        if palette_size:
+            palette_timeline, palette_freqs = process_image_palette(img, palette_size, mapping, columns_per_step, weighted)
+            timeline = palette_timeline_to_frequencies(palette_timeline, palette_freqs)
+            stats["palette_size"] = len(palette_freqs)
+        else:
+            timeline = process_image_optimized(img, mapping, columns_per_step, weighted)
+        stats["mapping"] = mapping
+        stats["processing_time"] = f"{time.time() - start_time:.3f}s"
+        if not timeline:
+            return jsonify({"error": "No valid colors detected"}), 400
         
         filename_base = f"upload_{int(time.time() * 1000)}"
         audio_filename = f"{filename_base}.wav"
@@ -640,48 +640,42 @@ def sonify_upload():
         
         if mode == 'colorfield':
             # Collect all frequencies
-            all_freqs = []
-            for x, freqs in timeline.items():
-                all_freqs.extend(freqs)
+            all_freqs = timeline.notes.tolist()
             
             # Generate drone
-            audio_data = generate_drone(all_freqs, duration=15) # 15s drone
+            audio_data = generate_drone(all_freqs, duration=15, rng=rng) # 15s drone
             
             # Generate MIDI
             frequencies_to_midi(all_freqs, midi_path)
             
         else: # Timeline mode
-            # Standard generation
-            stop = max((x for x, freqs in timeline.items() if freqs), default=0)
-            timeline_filled = {x: timeline.get(x, 0) for x in range(stop + 1)}
-            
-            audio_segments = []
-            # Faster playback for uploaded images? Or standard?
-            # Let's use a slightly faster duration per step for higher resolution feeling
-            step_dur = 0.05 
-            
-            for x in range(stop + 1):
-                segment = generate_tone(timeline_filled.get(x, 0), "round", duration=step_dur)
-                audio_segments.append(segment)
+            if sustain:
+                audio_data = render_sustained(
+                    timeline, lambda freqs, t: chord_tones(freqs, t, "round", rng=rng),
+                    int(SAMPLE_RATE * step_dur), SAMPLE_RATE, freq_range=TONE_RANGE
+                )
+            else:
+                # Standard generation, every step written into one buffer
+                audio_data = render_timeline(timeline, step_renderer("round", duration=step_dur), int(SAMPLE_RATE * step_dur))
                 
-            if not audio_segments:
+            if not len(audio_data):
                 return jsonify({"error": "No audio generated"}), 400
-                
-            audio_data = np.concatenate(audio_segments)
             
             # Generate MIDI
             frequencies_to_midi(timeline, midi_path)
 
         # Normalize and Write WAV
-        audio_data = audio_data / (np.max(np.abs(audio_data)) + 1e-6)
-        audio_int16 = np.int16(audio_data * 32767)
+        audio_int16 = normalize_to_int16(audio_data)
         write_wav(audio_path, SAMPLE_RATE, audio_int16)
         
-        return jsonify({
+        result = {
             "url": f"/static/audio/{audio_filename}",
             "midi_url": f"/static/audio/{midi_filename}",
-            "duration": len(audio_data) / SAMPLE_RATE
-        })
+            "duration": len(audio_data) / SAMPLE_RATE,
+            "stats": stats
+        }
+        result_cache.put(key, [audio_filename, midi_filename], result)
+        return jsonify(result)
 
     except Exception as e:
         logger.error(f"Error in upload: {e}")
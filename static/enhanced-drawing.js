@@ -16,6 +16,9 @@ function integrateRealTimeAudio() {
         const x = ((e.clientX || e.touches[0].clientX) - rect.left) * scaleX;
         const y = ((e.clientY || e.touches[0].clientY) - rect.top) * scaleY;
         
+        // Remember what changed so the next submission can send just this region
+        markCanvasDirty(x, y, brushSize);
+        
         // Get pixel color at drawing position with better accuracy
         const imageData = ctx.getImageData(Math.floor(x), Math.floor(y), 1, 1);
         const [r, g, b, a] = imageData.data;
@@ -464,6 +467,85 @@ function updateCanvasCursor(brushType) {
     canvas.style.cursor = cursors[brushType] || 'crosshair';
 }
 
+// Incremental submissions: the server keeps the last submitted canvas per session,
+// so later submissions only upload the region painted since then
+const canvasSync = {
+    synced: false,  // Server holds the canvas as of the last successful submission
+    dirty: null     // {x0, y0, x1, y1} changed since then, or null
+};
+
+// Past this share of the canvas a full upload is as cheap as a delta
+const FULL_UPLOAD_DIRTY_RATIO = 0.5;
+
+function markCanvasDirty(x, y, size) {
+    // Spray scatters dots up to twice the brush size from the pointer
+    const margin = Math.ceil(size * 2) + 2;
+    const x0 = Math.max(0, Math.floor(x - margin));
+    const y0 = Math.max(0, Math.floor(y - margin));
+    const x1 = Math.min(canvas.width, Math.ceil(x + margin));
+    const y1 = Math.min(canvas.height, Math.ceil(y + margin));
+    const dirty = canvasSync.dirty;
+    canvasSync.dirty = dirty ? {
+        x0: Math.min(dirty.x0, x0), y0: Math.min(dirty.y0, y0),
+        x1: Math.max(dirty.x1, x1), y1: Math.max(dirty.y1, y1)
+    } : { x0, y0, x1, y1 };
+}
+
+function markCanvasUnsynced() {
+    canvasSync.synced = false;
+    canvasSync.dirty = null;
+}
+
+// Undo, redo, clear and resize rewrite the whole canvas, so the next submission is a full one
+function trackCanvasResets() {
+    ['undo', 'redo', 'clearCanvas', 'restoreState'].forEach((name) => {
+        const original = window[name];
+        if (typeof original !== 'function') return;
+        window[name] = function(...args) {
+            markCanvasUnsynced();
+            return original.apply(this, args);
+        };
+    });
+    window.addEventListener('resize', markCanvasUnsynced);
+}
+
+async function submitCanvasDelta(brush) {
+    const dirty = canvasSync.dirty;
+    const rects = [];
+    if (dirty && dirty.x1 > dirty.x0 && dirty.y1 > dirty.y0) {
+        const patch = document.createElement('canvas');
+        patch.width = dirty.x1 - dirty.x0;
+        patch.height = dirty.y1 - dirty.y0;
+        patch.getContext('2d').drawImage(
+            canvas, dirty.x0, dirty.y0, patch.width, patch.height, 0, 0, patch.width, patch.height
+        );
+        rects.push({ x: dirty.x0, y: dirty.y0, image: patch.toDataURL("image/png") });
+    }
+    // Strokes made while the request is in flight start a new dirty region
+    canvasSync.dirty = null;
+    
+    const res = await fetch("/submit_delta", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ brush: brush, width: canvas.width, height: canvas.height, rects: rects }),
+    });
+    
+    // Canvas not on record (evicted, another worker, or no delta support): resend in full
+    if (res.status === 409 || res.status === 404) {
+        return null;
+    }
+    return res;
+}
+
+function shouldSubmitDelta() {
+    if (!canvasSync.synced) return false;
+    const dirty = canvasSync.dirty;
+    // No region on record: strokes may have bypassed the draw wrapper, so resend in full
+    if (!dirty) return false;
+    const dirtyArea = (dirty.x1 - dirty.x0) * (dirty.y1 - dirty.y0);
+    return dirtyArea < canvas.width * canvas.height * FULL_UPLOAD_DIRTY_RATIO;
+}
+
 // Advanced submission process with enhanced UX
 function enhanceSubmitProcess() {
     const originalSubmit = window.submitDrawing;
@@ -478,35 +560,44 @@ function enhanceSubmitProcess() {
         showEnhancedProgressIndicator();
         
         try {
-            const dataURL = canvas.toDataURL("image/png");
             const brush = document.getElementById("toolSelect").value;
             
-            // Add drawing analytics to submission
-            const analytics = window.drawingAnalytics || {};
-            const submissionData = {
-                image: dataURL,
-                brush: brush,
-                analytics: {
+            let res = shouldSubmitDelta() ? await submitCanvasDelta(brush) : null;
+            
+            if (!res) {
+                // Send the PNG as a binary part instead of a base64 data URL
+                const pngBlob = new Promise(resolve => canvas.toBlob(resolve, "image/png"));
+                canvasSync.dirty = null;
+                
+                // Add drawing analytics to submission
+                const analytics = window.drawingAnalytics || {};
+                const submissionData = new FormData();
+                submissionData.append("image", await pngBlob, "canvas.png");
+                submissionData.append("brush", brush);
+                submissionData.append("analytics", JSON.stringify({
                     totalStrokes: analytics.totalStrokes || 0,
                     colorCount: analytics.colorUsage ? analytics.colorUsage.size : 0,
                     dominantColor: getDominantColor(analytics.colorUsage),
                     drawingTime: analytics.startTime ? Date.now() - analytics.startTime : 0
-                }
-            };
-            
-            const res = await fetch("/submit", {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify(submissionData),
-            });
+                }));
+                
+                res = await fetch("/submit", {
+                    method: "POST",
+                    body: submissionData,
+                });
+            }
             
             const data = await res.json();
             
             if (data.error) {
+                markCanvasUnsynced();
                 handleError(data.error);
                 return;
             }
             
+            // The server now holds the canvas as it was sent
+            canvasSync.synced = true;
+            
             // Success - play the generated audio with celebration
             const player = document.getElementById("player");
             player.src = data.url + "?t=" + new Date().getTime();
@@ -867,6 +958,7 @@ if (document.readyState === 'loading') {
         enhanceColorPicker();
         enhanceBrushSelector();
         enhanceSubmitProcess();
+        trackCanvasResets();
         
         console.log('Enhanced Drawing Interface initialized with all features');
     });
@@ -875,6 +967,7 @@ if (document.readyState === 'loading') {
     enhanceColorPicker();
     enhanceBrushSelector();
     enhanceSubmitProcess();
+    trackCanvasResets();
     
     console.log('Enhanced Drawing Interface initialized with all features');
 }
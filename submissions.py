@@ -0,0 +1,28 @@
+# Reading /submit Request Bodies
+import base64
+from typing import Optional, Tuple
+
+from flask import request
+
+# Bodies that are the image itself, with submit settings in the query string
+RAW_IMAGE_TYPES = {'image/png', 'image/jpeg', 'image/webp', 'application/octet-stream'}
+
+
+def read_submission() -> Tuple[dict, Optional[bytes]]:
+    """Return (settings, encoded image bytes) for the current /submit request
+
+    Accepts multipart/form-data with an ``image`` file part, a raw image body, or the
+    original JSON body with a base64 data URL. Binary bodies are read once, skipping the
+    base64 text and its decoded copy. The image is None when missing or empty.
+    """
+    if request.mimetype == 'multipart/form-data':
+        settings, upload = request.form, request.files.get('image')
+    elif request.mimetype in RAW_IMAGE_TYPES:
+        settings, upload = request.args, request.stream
+    else:
+        settings = request.get_json(silent=True) or {}
+        if 'image' not in settings:
+            return settings, None
+        return settings, base64.b64decode(settings['image'].split(',')[1]) or None
+    raw = upload.read() if upload is not None else b''
+    return settings, raw or None
@@ -0,0 +1,147 @@
+# Vectorized Chord Synthesis
+import numpy as np
+
+# Notes per broadcast call; keeps each (notes x samples) matrix cache-sized for dense chords
+CHORD_BLOCK = 16
+# Samples per call when rendering long note events, so held notes never build a full-length matrix
+EVENT_CHUNK = 4096
+
+
+def chord_phase(frequencies, t) -> np.ndarray:
+    """Phase matrix for a whole chord, shape (n_notes, len(t)): row i is 2π·frequencies[i]·t
+
+    ``frequencies`` may also be an (n_notes, len(t)) array of per-sample frequencies, for
+    modulated partials. Brush and instrument shaping is then plain array math on the matrix.
+    """
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    if frequencies.ndim == 1:
+        frequencies = frequencies[:, None]
+    return 2 * np.pi * frequencies * t
+
+
+def mix_partials(tones: np.ndarray, amplitudes=None) -> np.ndarray:
+    """Sum an (n_notes, n_samples) tone matrix into one signal, weighting rows by ``amplitudes``"""
+    if amplitudes is None:
+        return tones.sum(axis=0)
+    return np.asarray(amplitudes, dtype=np.float64) @ tones
+
+
+def render_chord(frequencies, voice_fn, amplitudes=None, block: int = CHORD_BLOCK) -> np.ndarray:
+    """Mix ``voice_fn`` over a whole chord, ``block`` notes per vectorized call
+
+    ``voice_fn(freqs)`` maps a 1-D array of frequencies to an (n_notes, n_samples) tone
+    matrix, typically built from chord_phase. Random draws inside it see the same row-major
+    sequence as one call over every note, so seeded renders do not depend on ``block``.
+    Silent (empty) chords are left to the caller.
+    """
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    waveform = 0
+    for start in range(0, len(frequencies), block):
+        stop = start + block
+        tones = voice_fn(frequencies[start:stop])
+        waveform = waveform + mix_partials(tones, None if amplitudes is None else amplitudes[start:stop])
+    return waveform
+
+
+def render_timeline(timeline, tone_fn, samples_per_step: int, dtype=np.float64) -> np.ndarray:
+    """Render a whole Timeline into one preallocated buffer of len(timeline) steps
+
+    ``tone_fn(notes, amplitudes)`` returns one step of ``samples_per_step`` samples and is
+    written straight into its slot. Silent steps are never rendered; they stay zero.
+    """
+    out = np.zeros(len(timeline) * samples_per_step, dtype=dtype)
+    for x, notes in timeline.items():
+        out[x * samples_per_step:(x + 1) * samples_per_step] = tone_fn(notes, timeline.column_amplitudes(x))
+    return out
+
+
+def cached_step_renderer(cache, tone_fn, **params):
+    """Per-step ``tone_fn`` for render_timeline and CanvasState.render, backed by a SegmentCache
+
+    ``tone_fn(notes, rng=..., amplitudes=...)`` only runs on a miss. Its rng is seeded from the
+    segment key, so a chord renders the same wherever it appears and noisy brushes are cached
+    too. ``params`` must name every other setting that shapes the samples.
+    """
+    def render_step(notes, amplitudes=None):
+        return cache.get_or_render(
+            notes, amplitudes, lambda rng: tone_fn(notes, rng=rng, amplitudes=amplitudes), **params
+        )
+    return render_step
+
+
+def normalize_to_int16(audio: np.ndarray, headroom: float = 1e-6) -> np.ndarray:
+    """Peak-normalize ``audio`` in place and return it as 16-bit PCM
+
+    The peak is found without an abs() copy, and the only new allocation is the int16 result.
+    """
+    if len(audio) == 0:
+        return np.zeros(0, dtype=np.int16)
+    peak = max(float(audio.max()), -float(audio.min()))
+    np.multiply(audio, 32767 / (peak + headroom), out=audio)
+    return audio.astype(np.int16)
+
+
+def note_envelope(n_samples: int, attack: int, release: int, decay: float = 3.0) -> np.ndarray:
+    """Linear attack, sustain at 1, then an exponential release that lands exactly on zero
+
+    With ``attack + release`` spanning the whole note this is the per-step envelope shape,
+    minus the step at the end that used to click.
+    """
+    envelope = np.ones(n_samples)
+    attack = min(attack, n_samples)
+    release = min(release, n_samples - attack)
+    envelope[:attack] = np.linspace(0, 1, attack)
+    if release:
+        tail = np.exp(-decay * np.linspace(0, 1, release))
+        envelope[n_samples - release:] = (tail - tail[-1]) / (1 - tail[-1])
+    return envelope
+
+
+def render_events(events, tone_fn, samples_per_step: int, sample_rate: int, attack: float = 0.05,
+                  decay: float = 3.0, dtype=np.float64, chunk: int = EVENT_CHUNK) -> np.ndarray:
+    """Render NoteEvents into one buffer, synthesizing each event once with continuous phase
+
+    ``tone_fn(frequencies, t)`` returns an (n_notes, len(t)) tone matrix with t counted from
+    the note's start. Events of equal length share broadcast calls (CHORD_BLOCK notes at a
+    time), so cost follows the number of notes rather than columns x notes. Long events are
+    rendered ``chunk`` samples at a time, with t offset into the note so phase runs on across
+    chunks. ``attack`` is a fraction of one step; the release fills each event's last step.
+    """
+    out = np.zeros(events.n_steps * samples_per_step, dtype=dtype)
+    attack_len = max(1, int(attack * samples_per_step))
+    for length in np.unique(events.lengths):
+        n_samples = int(length) * samples_per_step
+        # One-step notes keep the per-step shape: attack, then release for the rest
+        release = samples_per_step - attack_len if length == 1 else samples_per_step
+        envelope = note_envelope(n_samples, attack_len, release, decay)
+        group = np.flatnonzero(events.lengths == length)
+        for block in range(0, len(group), CHORD_BLOCK):
+            rows = group[block:block + CHORD_BLOCK]
+            notes = events.notes[rows].astype(np.float64)
+            amplitudes = events.amplitudes[rows].astype(np.float64)
+            # Events are sorted by start; notes that start together are mixed before enveloping
+            starts, runs = np.unique(events.starts[rows], return_index=True)
+            runs = np.append(runs, len(rows))
+            for offset in range(0, n_samples, chunk):
+                stop = min(offset + chunk, n_samples)
+                tones = tone_fn(notes, np.arange(offset, stop) / sample_rate)
+                for start, lo, hi in zip(starts * samples_per_step, runs[:-1], runs[1:]):
+                    mixed = mix_partials(tones[lo:hi], amplitudes[lo:hi])
+                    mixed *= envelope[offset:stop]
+                    out[start + offset:start + stop] += mixed
+    return out
+
+
+def render_sustained(timeline, voice_fn, samples_per_step: int, sample_rate: int,
+                     freq_range=(20, 20000), **envelope) -> np.ndarray:
+    """Render a timeline as note events: a frequency held across consecutive steps is one
+    note, synthesized once with continuous phase instead of restarting every step
+
+    ``voice_fn(frequencies, t)`` is an app's brush voice, given notes clipped to ``freq_range``.
+    ``envelope`` (attack, decay) is passed on to render_events.
+    """
+    low, high = freq_range
+    return render_events(
+        timeline.to_events(), lambda freqs, t: voice_fn(np.clip(freqs, low, high), t),
+        samples_per_step, sample_rate, **envelope
+    )
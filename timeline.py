@@ -0,0 +1,214 @@
+# Column Timeline Construction
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageChops
+
+# In weighted timelines, notes covering less than this share of a step's painted pixels are dropped
+MIN_NOTE_SHARE = 0.01
+
+
+class Timeline:
+    """Compact column timeline in CSR layout
+
+    Column x holds ``notes[offsets[x]:offsets[x + 1]]`` (and the matching ``amplitudes``
+    when present). Notes are float32 frequencies, or uint8 indices for palette timelines.
+    Silent columns are empty ranges, so they cost one int32 offset instead of a dict entry.
+    The timeline spans columns 0 through the last sounding column.
+    """
+
+    def __init__(self, offsets, notes, amplitudes=None):
+        self.offsets = np.asarray(offsets, dtype=np.int32)
+        self.notes = np.asarray(notes)
+        self.amplitudes = None if amplitudes is None else np.asarray(amplitudes, dtype=np.float32)
+
+    @classmethod
+    def from_entries(cls, columns, notes, amplitudes=None, note_dtype=np.float32) -> 'Timeline':
+        """Build from parallel entry arrays already sorted by column"""
+        columns = np.asarray(columns, dtype=np.int64)
+        if len(columns) == 0:
+            return cls.empty(note_dtype)
+        counts = np.bincount(columns, minlength=int(columns[-1]) + 1)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        return cls(offsets, np.asarray(notes, dtype=note_dtype), amplitudes)
+
+    @classmethod
+    def empty(cls, note_dtype=np.float32) -> 'Timeline':
+        return cls(np.zeros(1), np.zeros(0, dtype=note_dtype))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __bool__(self) -> bool:
+        return len(self.notes) > 0
+
+    def __getitem__(self, x: int) -> np.ndarray:
+        return self.notes[self.offsets[x]:self.offsets[x + 1]]
+
+    def column_amplitudes(self, x: int) -> Optional[np.ndarray]:
+        if self.amplitudes is None:
+            return None
+        return self.amplitudes[self.offsets[x]:self.offsets[x + 1]]
+
+    def items(self) -> Iterator[Tuple[int, np.ndarray]]:
+        """Yield (x, notes) for sounding columns only, like the old dict timeline"""
+        for x in np.flatnonzero(np.diff(self.offsets)):
+            yield int(x), self[x]
+
+    def column_index(self) -> np.ndarray:
+        """Column number of every entry in ``notes``"""
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    @property
+    def non_silent_columns(self) -> int:
+        return int(np.count_nonzero(np.diff(self.offsets)))
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.notes.nbytes + (0 if self.amplitudes is None else self.amplitudes.nbytes)
+
+    def to_events(self) -> 'NoteEvents':
+        """Merge runs of the same note in consecutive columns into sustained note events
+
+        Entries are sorted by (note, column) once; a new event starts wherever the note
+        changes or a column is skipped. Weighted timelines give each event the mean
+        amplitude of its run.
+        """
+        if not self:
+            return NoteEvents.empty(self.notes.dtype)
+        columns = self.column_index()
+        order = np.lexsort((columns, self.notes))
+        columns, notes = columns[order], self.notes[order]
+        amplitudes = np.ones(len(notes)) if self.amplitudes is None else self.amplitudes[order]
+        new_event = np.ones(len(notes), dtype=bool)
+        new_event[1:] = (notes[1:] != notes[:-1]) | (columns[1:] != columns[:-1] + 1)
+        first = np.flatnonzero(new_event)
+        lengths = np.diff(np.append(first, len(notes)))
+        event_amplitudes = np.add.reduceat(amplitudes, first) / lengths
+        by_start = np.argsort(columns[first], kind='stable')
+        first = first[by_start]
+        return NoteEvents(columns[first], lengths[by_start], notes[first], event_amplitudes[by_start])
+
+    def to_json(self) -> Dict[str, list]:
+        data = {"offsets": self.offsets.tolist(), "notes": self.notes.tolist()}
+        if self.amplitudes is not None:
+            data["amplitudes"] = self.amplitudes.tolist()
+        return data
+
+
+class NoteEvents:
+    """Sustained notes: event i plays ``notes[i]`` from step ``starts[i]`` for ``lengths[i]`` steps"""
+
+    def __init__(self, starts, lengths, notes, amplitudes):
+        self.starts = np.asarray(starts, dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.int32)
+        self.notes = np.asarray(notes)
+        self.amplitudes = np.asarray(amplitudes, dtype=np.float32)
+
+    @classmethod
+    def empty(cls, note_dtype=np.float32) -> 'NoteEvents':
+        return cls(np.zeros(0), np.zeros(0), np.zeros(0, dtype=note_dtype), np.zeros(0))
+
+    def __len__(self) -> int:
+        return len(self.notes)
+
+    @property
+    def n_steps(self) -> int:
+        """Steps spanned, through the end of the last event"""
+        return int((self.starts + self.lengths).max()) if len(self) else 0
+
+
+def crop_to_painted(img: Image.Image) -> Tuple[Optional[Image.Image], int]:
+    """Crop an RGBA image to the pixels that can sound (alpha > 200 and not pure black)
+
+    Runs on PIL bands, so mostly transparent canvases skip the per-pixel array work.
+    Returns (cropped image, x offset of the crop), or (None, 0) when nothing would sound.
+    """
+    opaque = img.getchannel('A').point(lambda a: 255 if a > 200 else 0)
+    bbox = opaque.getbbox()
+    if bbox is None:
+        return None, 0
+    # Zero out pixels hidden by alpha, then shrink further past pure-black content
+    visible = ImageChops.multiply(img.crop(bbox).convert('RGB'), opaque.crop(bbox).convert('RGB'))
+    inner = visible.getbbox()
+    if inner is None:
+        return None, 0
+    box = (bbox[0] + inner[0], bbox[1] + inner[1], bbox[0] + inner[2], bbox[1] + inner[3])
+    return img.crop(box), box[0]
+
+
+def resolve_columns_per_step(width: int, step_duration: float, columns_per_step=None, duration=None) -> int:
+    """Turn a time-resolution request into the number of pixel columns sharing one step
+
+    ``columns_per_step`` wins when given; otherwise ``duration`` (seconds for the full
+    canvas width) is converted at ``step_duration`` seconds per step. Raises ValueError
+    for values that cannot be used.
+    """
+    if columns_per_step is not None:
+        columns_per_step = int(columns_per_step)
+        if columns_per_step < 1:
+            raise ValueError("columns_per_step must be at least 1")
+        return columns_per_step
+    if duration is not None:
+        duration = float(duration)
+        if not duration > 0:
+            raise ValueError("duration must be positive")
+        return max(1, int(np.ceil(width * step_duration / duration)))
+    return 1
+
+
+def parse_flag(value) -> bool:
+    """Read an on/off request setting from JSON (bool) or form/query strings"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def column_shares(columns: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Each entry's fraction of the total count in its column; columns must be sorted"""
+    return counts / np.bincount(columns, weights=counts)[columns]
+
+
+def build_column_timeline(xs, frequencies, columns_per_step: int = 1, weighted: bool = False,
+                          weights=None, min_share: float = MIN_NOTE_SHARE,
+                          step_capacity: Optional[float] = None) -> Timeline:
+    """Group per-pixel frequencies by column into a Timeline of sorted unique frequencies
+
+    Frequencies are ranked once, paired with their column as x * n_notes + rank, and a
+    single np.unique over those keys both deduplicates and orders every column. With
+    ``columns_per_step`` > 1, adjacent columns are binned into one step first.
+
+    With ``weighted``, one np.bincount over the same keys counts pixels per note instead
+    (each pixel counting ``weights[i]`` when given), and notes below ``min_share`` of the
+    step's painted pixels are dropped. Amplitudes are counts over ``step_capacity`` (the
+    pixels one step holds, image height x columns_per_step), so a thin stroke stays quieter
+    than a wide band in any step; pass 1 when ``weights`` are amplitudes already. Without
+    it, amplitudes are each note's share of its step.
+    """
+    xs = np.asarray(xs) // columns_per_step
+    # Rank in storage precision so columns stay duplicate-free after the float32 cast
+    frequencies = np.asarray(frequencies, dtype=np.float32)
+    keep = frequencies > 0
+    xs, frequencies = xs[keep], frequencies[keep]
+    if len(xs) == 0:
+        return Timeline.empty()
+    notes, note_index = np.unique(frequencies, return_inverse=True)
+    keys = xs.astype(np.int64) * len(notes) + note_index.reshape(-1)
+    if not weighted:
+        columns, entries = np.divmod(np.unique(keys), len(notes))
+        return Timeline.from_entries(columns, notes[entries])
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)[keep]
+    if int(keys.max()) < 8 * len(keys):
+        counts = np.bincount(keys, weights=weights)
+        keys = np.flatnonzero(counts)
+        counts = counts[keys]
+    else:
+        # Sparse key space (many distinct notes); count over the compacted keys instead
+        keys, key_index = np.unique(keys, return_inverse=True)
+        counts = np.bincount(key_index.reshape(-1), weights=weights)
+    columns, entries = np.divmod(keys, len(notes))
+    shares = column_shares(columns, counts)
+    audible = shares >= min_share
+    amplitudes = shares if step_capacity is None else counts / step_capacity
+    return Timeline.from_entries(columns[audible], notes[entries[audible]], amplitudes[audible])